@@ -1,17 +1,26 @@
+from functools import cached_property, lru_cache
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Tuple
 
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./data/chat.db"
     cors_origins: str = "http://localhost:3000,http://localhost:5173"
+    db_pool_size: int = 4  # read-only SQLite connections; writes use one more
     
-    @property
-    def cors_origins_list(self) -> List[str]:
-        return [origin.strip() for origin in self.cors_origins.split(",")]
+    @cached_property
+    def cors_origins_list(self) -> Tuple[str, ...]:
+        # Empty entries (e.g. a trailing comma) are dropped
+        return tuple(origin.strip() for origin in self.cors_origins.split(",") if origin.strip())
     
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings once per process (reads .env and validates fields)"""
+    return Settings()
+
+
+settings = get_settings()
@@ -1,8 +1,18 @@
 import aiosqlite
+import asyncio
+import logging
 import os
+import sqlite3
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from config import settings
 
+logger = logging.getLogger(__name__)
+
 
 def get_db_path() -> str:
     """Extract the actual file path from DATABASE_URL"""
@@ -16,12 +26,373 @@ def get_db_path() -> str:
     return "data/chat.db"
 
 
-async def get_db():
-    """Get database connection"""
-    db_path = get_db_path()
-    db = await aiosqlite.connect(db_path)
-    db.row_factory = aiosqlite.Row
-    return db
+async def _apply_pragmas(db: aiosqlite.Connection):
+    """Apply per-connection performance PRAGMAs.
+
+    WAL is persistent in the database file, so it is never toggled back. It
+    needs the data directory to be writable for the `-wal` and `-shm` files
+    SQLite keeps next to the database.
+    """
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache per connection
+    await db.execute("PRAGMA mmap_size=268435456")
+    await db.execute("PRAGMA foreign_keys=ON")
+
+
+# Prepared statements kept per pooled connection (sqlite3 defaults to 128)
+STATEMENT_CACHE_SIZE = 256
+
+
+class _ReaderConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers the cursors it has handed out.
+
+    A SELECT that was not read to the end keeps its WAL read snapshot open
+    even outside a transaction, so the pool closes leftover cursors before a
+    reader goes back on the queue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+
+    def cursor(self, *args, **kwargs):
+        cursor = super().cursor(*args, **kwargs)
+        self._cursors.add(cursor)
+        return cursor
+
+    def execute(self, *args):
+        # sqlite3's own execute() doesn't go through cursor()
+        cursor = self.cursor()
+        return cursor.execute(*args)
+
+    def close_cursors(self):
+        for cursor in list(self._cursors):
+            cursor.close()
+        self._cursors.clear()
+
+
+class ConnectionPool:
+    """Small pool of long-lived aiosqlite connections.
+
+    Reads share `size` connections handed out through a queue. All writes go
+    through a single dedicated connection behind a lock, which matches SQLite's
+    single-writer model and means readers never block the writer.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._connections: List[aiosqlite.Connection] = []
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        # Long-lived connections, so give sqlite3's prepared statement cache more room
+        db = await aiosqlite.connect(
+            get_db_path(),
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=_ReaderConnection if read_only else sqlite3.Connection,
+        )
+        db.row_factory = aiosqlite.Row
+        await _apply_pragmas(db)
+        if read_only:
+            await db.execute("PRAGMA query_only=ON")
+        # Load the schema now so the first real query doesn't pay for parsing it.
+        # Fetched to completion: an unfinished SELECT keeps its read transaction
+        # open, pinning the connection to a stale WAL snapshot.
+        await db.execute_fetchall("SELECT count(*) FROM sqlite_master")
+        self._connections.append(db)
+        return db
+
+    async def open(self):
+        """Open the writer and reader connections (idempotent)"""
+        async with self._open_lock:
+            if self._connections:
+                return
+            self._writer = await self._connect()
+            for _ in range(self.size):
+                self._readers.put_nowait(await self._connect(read_only=True))
+
+    async def close(self):
+        """Close every pooled connection"""
+        async with self._open_lock:
+            for db in self._connections:
+                await db.close()
+            self._connections.clear()
+            self._writer = None
+            self._readers = asyncio.Queue()
+
+    async def acquire(self) -> aiosqlite.Connection:
+        """Take a read-only connection from the pool"""
+        if not self._connections:
+            await self.open()
+        return await self._readers.get()
+
+    async def release(self, db: aiosqlite.Connection):
+        """Return a connection obtained from acquire()"""
+        # Runs on the connection's own thread, after anything still queued on it
+        await db._execute(db._conn.close_cursors)
+        if db.in_transaction:
+            await db.rollback()
+        self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def connection(self):
+        """`async with db_pool.connection() as db:` for read-only work"""
+        db = await self.acquire()
+        try:
+            yield db
+        finally:
+            await self.release(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """`async with db_pool.writer() as db:` for anything that writes"""
+        if not self._connections:
+            await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            finally:
+                # Never hand a half-finished transaction to the next writer
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+
+# Global connection pool, opened in the app lifespan
+db_pool = ConnectionPool(settings.db_pool_size)
+
+
+async def db_conn():
+    """FastAPI dependency: a pooled read-only connection for the request"""
+    async with db_pool.connection() as db:
+        yield db
+
+
+async def db_writer():
+    """FastAPI dependency: the writer connection, held for the whole request"""
+    async with db_pool.writer() as db:
+        yield db
+
+
+SQL_INSERT_MESSAGE = """
+    INSERT INTO messages (session_id, role, content, timestamp)
+    SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE id = ?)
+"""
+
+
+class MessageWriter:
+    """Write-behind batcher for message inserts.
+
+    Callers enqueue rows and return immediately; a background task collects up
+    to `batch_size` rows (or whatever arrives within `flush_interval` seconds)
+    and inserts them with one executemany inside a single transaction, which
+    also bumps last_activity on the sessions involved (at most once every
+    `activity_interval` seconds per session).
+    """
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 0.025,
+                 activity_interval: float = 30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # last_activity is bumped at most this often (seconds) per session
+        self.activity_interval = activity_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._touched: Dict[int, float] = {}
+
+    def start(self):
+        """Start the background flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, session_id: int, role: str, content: str, timestamp: int = None):
+        """Queue a message row for insertion (timestamp in ms, defaults to now)"""
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        self._queue.put_nowait((session_id, role, content, timestamp))
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logger.error("failed to write %d messages: %s", len(batch), e)
+
+            if stopping:
+                return
+
+    async def _write(self, batch: list):
+        now = time.monotonic()
+        # Forget sessions whose last bump is old enough to be due again
+        self._touched = {
+            sid: touched for sid, touched in self._touched.items()
+            if now - touched < self.activity_interval
+        }
+        session_ids = {row[0] for row in batch} - self._touched.keys()
+        async with db_pool.writer() as db:
+            await db.execute("BEGIN")
+            # Rows for a session deleted since they were queued are skipped
+            # rather than failing the whole batch on the foreign key
+            await db.executemany(SQL_INSERT_MESSAGE, [(*row, row[0]) for row in batch])
+            if session_ids:
+                await db.execute(
+                    f"UPDATE sessions SET last_activity = CURRENT_TIMESTAMP "
+                    f"WHERE id IN ({','.join('?' * len(session_ids))})",
+                    tuple(session_ids)
+                )
+            await db.commit()
+        self._touched.update(dict.fromkeys(session_ids, now))
+
+
+# Global message writer, started in the app lifespan
+message_writer = MessageWriter()
+
+
+
+class SessionIdCache:
+    """LRU map of (gateway_id, session_key) -> sessions.id.
+
+    Only this backend writes the sessions table, so entries stay valid until
+    the session (or its gateway) is deleted, which must call invalidate().
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+    def get(self, gateway_id: str, session_key: str) -> Optional[int]:
+        key = (gateway_id, session_key)
+        session_id = self._ids.get(key)
+        if session_id is not None:
+            self._ids.move_to_end(key)
+        return session_id
+
+    def put(self, gateway_id: str, session_key: str, session_id: int):
+        key = (gateway_id, session_key)
+        self._ids[key] = session_id
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def invalidate(self, gateway_id: str, session_key: Optional[str] = None):
+        """Forget one session, or every session of a gateway when session_key is None"""
+        if session_key is not None:
+            self._ids.pop((gateway_id, session_key), None)
+            return
+        for key in [k for k in self._ids if k[0] == gateway_id]:
+            del self._ids[key]
+
+
+# Global session id cache
+session_ids = SessionIdCache()
+
+
+MESSAGES_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL REFERENCES sessions(id),
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp INTEGER NOT NULL
+    ) STRICT
+"""
+
+# Covering index for per-session history reads; ordering by
+# (timestamp, id) lets these queries skip both the sort and the table
+MESSAGES_INDEX = "idx_messages_session_cov"
+MESSAGES_INDEX_DDL = f"""
+    CREATE INDEX IF NOT EXISTS {MESSAGES_INDEX}
+    ON messages(session_id, timestamp, id, role, content)
+"""
+
+# Batches smaller than this always insert through the index
+BULK_INSERT_THRESHOLD = 1000
+
+
+async def bulk_insert_messages(db: aiosqlite.Connection, rows: List[tuple]):
+    """Insert many (session_id, role, content, timestamp_ms) rows in one transaction.
+
+    For large backfills (bigger than the table already is) the messages index
+    is dropped and rebuilt around the insert. It all happens in one
+    transaction, so WAL readers never see the table without its index.
+    Callers must hold the writer connection.
+    """
+    cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+    existing = (await cursor.fetchone())[0]
+    rebuild_index = len(rows) > max(BULK_INSERT_THRESHOLD, existing)
+
+    await db.execute("BEGIN")
+    try:
+        if rebuild_index:
+            await db.execute(f"DROP INDEX IF EXISTS {MESSAGES_INDEX}")
+        await db.executemany(
+            "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        if rebuild_index:
+            await db.execute(MESSAGES_INDEX_DDL)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def _migrate_messages_table(db: aiosqlite.Connection):
+    """Rebuild a pre-STRICT messages table, folding created_at into timestamp (ms)"""
+    cursor = await db.execute("PRAGMA table_info(messages)")
+    columns = {row["name"] for row in await cursor.fetchall()}
+    if "created_at" not in columns:
+        return
+
+    await db.execute("BEGIN")
+    try:
+        await db.execute(MESSAGES_TABLE_DDL.format(name="messages_new"))
+        await db.execute("""
+            INSERT INTO messages_new (id, session_id, role, content, timestamp)
+            SELECT id, session_id, role, content,
+                   COALESCE(timestamp, CAST(strftime('%s', created_at) AS INTEGER) * 1000, 0)
+            FROM messages
+        """)
+        await db.execute("DROP TABLE messages")
+        await db.execute("ALTER TABLE messages_new RENAME TO messages")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    logger.info("migrated messages table to STRICT schema")
 
 
 async def init_db():
@@ -33,6 +404,7 @@ async def init_db():
 
     db = await aiosqlite.connect(db_path)
     db.row_factory = aiosqlite.Row
+    await _apply_pragmas(db)
     
     try:
         # Create gateways table
@@ -61,24 +433,18 @@ async def init_db():
                 UNIQUE(gateway_id, session_key)
             )
         """)
-        
-        # Create messages table
+        # Covers the per-gateway session list, most recent first
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL REFERENCES sessions(id),
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+            CREATE INDEX IF NOT EXISTS idx_sessions_gateway_activity
+            ON sessions(gateway_id, last_activity DESC, id, session_key, title, agent_id, model, created_at)
         """)
         
-        # Create index
-        await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_session
-            ON messages(session_id, created_at)
-        """)
+        # Create messages table
+        await db.execute(MESSAGES_TABLE_DDL.format(name="messages"))
+        await _migrate_messages_table(db)
+        
+        await db.execute("DROP INDEX IF EXISTS idx_messages_session")
+        await db.execute(MESSAGES_INDEX_DDL)
 
         # Create federated_sessions table
         await db.execute("""
@@ -99,6 +465,7 @@ async def init_db():
                 PRIMARY KEY (federated_session_id, gateway_id)
             )
         """)
+        # The primary key's index already serves lookups by federated_session_id
 
         # Create devices table
         await db.execute("""
@@ -146,7 +513,7 @@ async def init_db():
             ))
 
         await db.commit()
-        print("✅ Database initialized successfully")
+        logger.info("database initialized")
         
     finally:
         await db.close()
@@ -1,16 +1,26 @@
 import asyncio
+import logging
 import websockets
-import json
-import uuid
+import orjson
 import re
-from typing import Dict, Optional, Any, Callable
+from typing import Dict, Optional, Any, Callable, Set
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+
+# Thinking blocks stripped from assistant responses (open and close tag must match)
+_THINK_RE = re.compile(r'<(think|thinking|antthinking)>.*?</\1>', re.DOTALL)
+
+# Scopes requested on connect (a tuple so the shared value can't be mutated)
+_OPERATOR_SCOPES = ("operator.read", "operator.write", "operator.admin", "operator.approvals", "operator.pairing")
+
 
 class GatewayConnection:
     """Manages a persistent WebSocket connection to an OpenClaw gateway"""
     
-    def __init__(self, gateway_id: str, url: str, token: Optional[str] = None, password: Optional[str] = None):
+    def __init__(self, gateway_id: str, url: str, token: Optional[str] = None, password: Optional[str] = None,
+                 spawn: Optional[Callable] = None):
         self.gateway_id = gateway_id
         self.url = url
         self.token = token
@@ -21,33 +31,48 @@ class GatewayConnection:
         self.max_reconnect_delay = 60
         self.running = False
         self.req_id_counter = 0
-        self.pending_requests: Dict[str, asyncio.Future] = {}
-        self.event_handlers: Dict[str, list] = {}
+        self.pending_requests: Dict[int, asyncio.Future] = {}
+        self.event_handlers: Dict[str, tuple] = {}
         self.agents = []
         self.models = []
         self.default_model = None
         self.reconnect_callbacks: list = []
+        # Background tasks are created through the owner's spawner so they can be tracked and cancelled
+        self._spawn = spawn or asyncio.create_task
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Connect params that don't change between reconnects
+        self._static_connect_params = {
+            "role": "operator",
+            "scopes": _OPERATOR_SCOPES,
+            "permissions": {
+                "operator.admin": True,
+                "operator.approvals": True,
+                "operator.pairing": True,
+            },
+            "client": {
+                "id": "openclaw-control-ui",
+                "version": "2.0.0",
+                "platform": "web",
+                "mode": "webchat",
+                "instanceId": f"backend_{self.gateway_id}"
+            },
+            "minProtocol": 3,
+            "maxProtocol": 3
+        }
         
     def strip_thinking_tags(self, text: str) -> str:
         """Strip thinking tags from assistant responses"""
-        patterns = [
-            r'<think>.*?</think>',
-            r'<thinking>.*?</thinking>',
-            r'<antthinking>.*?</antthinking>'
-        ]
-        for pattern in patterns:
-            text = re.sub(pattern, '', text, flags=re.DOTALL)
-        return text.strip()
+        return _THINK_RE.sub('', text).strip()
     
-    def next_req_id(self) -> str:
-        """Generate next request ID"""
+    def next_req_id(self) -> int:
+        """Generate next request ID (stringified only when serialized)"""
         self.req_id_counter += 1
-        return f"r{self.req_id_counter}"
+        return self.req_id_counter
     
     async def connect(self):
         """Establish connection and perform handshake"""
         try:
-            print(f"🔌 Connecting to gateway {self.gateway_id} at {self.url}")
+            logger.info("connecting to gateway %s at %s", self.gateway_id, self.url)
             # Use the gateway's own host as origin so it passes origin checks
             from urllib.parse import urlparse
             parsed = urlparse(self.url)
@@ -55,16 +80,23 @@ class GatewayConnection:
             port = parsed.port or 18789
             origin = f"http://{host}:{port}"
             self.ws = await asyncio.wait_for(
-                websockets.connect(self.url, origin=origin, open_timeout=10),
+                websockets.connect(
+                    self.url,
+                    origin=origin,
+                    open_timeout=10,
+                    max_size=2**22,
+                    read_limit=2**20,
+                    write_limit=2**20
+                ),
                 timeout=15
             )
             
             # Wait for connect.challenge
             challenge_msg = await self.ws.recv()
-            challenge = json.loads(challenge_msg)
+            challenge = orjson.loads(challenge_msg)
             
             if challenge.get("type") == "event" and challenge.get("event") == "connect.challenge":
-                print(f"✅ Received challenge from {self.gateway_id}")
+                logger.debug("challenge received from %s", self.gateway_id)
                 
                 # Build auth object exactly like frontend (gateway.ts:126-128)
                 auth = {}
@@ -73,45 +105,26 @@ class GatewayConnection:
                 if self.password:
                     auth["password"] = self.password
 
-                # Send connect request matching frontend exactly (gateway.ts:133-156)
+                # Send connect request matching frontend exactly (gateway.ts:133-156);
+                # auth is omitted when empty, like the frontend's None-stripping
+                params = {"auth": auth, **self._static_connect_params} if auth else self._static_connect_params
                 connect_req = {
                     "type": "req",
-                    "id": self.next_req_id(),
+                    "id": str(self.next_req_id()),
                     "method": "connect",
-                    "params": {
-                        "auth": auth if len(auth) > 0 else None,
-                        "role": "operator",
-                        "scopes": ["operator.read", "operator.write", "operator.admin", "operator.approvals", "operator.pairing"],
-                        "permissions": {
-                            "operator.admin": True,
-                            "operator.approvals": True,
-                            "operator.pairing": True,
-                        },
-                        "client": {
-                            "id": "openclaw-control-ui",
-                            "version": "2.0.0",
-                            "platform": "web",
-                            "mode": "webchat",
-                            "instanceId": f"backend_{self.gateway_id}"
-                        },
-                        "minProtocol": 3,
-                        "maxProtocol": 3
-                    }
+                    "params": params
                 }
-
-                # Strip None values from params (matches frontend behavior)
-                connect_req["params"] = {k: v for k, v in connect_req["params"].items() if v is not None}
                 
-                await self.ws.send(json.dumps(connect_req))
+                await self.ws.send(orjson.dumps(connect_req).decode())
                 
                 # Wait for connect response
                 connect_res = await self.ws.recv()
-                response = json.loads(connect_res)
+                response = orjson.loads(connect_res)
                 
                 if response.get("ok"):
                     self.connected = True
                     self.reconnect_delay = 1
-                    print(f"✅ Connected to gateway {self.gateway_id}")
+                    logger.info("connected to gateway %s", self.gateway_id)
                     
                     # Extract default model from snapshot
                     snapshot = response.get("payload", {}).get("snapshot", {})
@@ -121,14 +134,14 @@ class GatewayConnection:
                     # Note: fetch_metadata is called from _start_connect after listen() starts
                     return True
                 else:
-                    print(f"❌ Connection failed for {self.gateway_id}: {response}")
+                    logger.error("connection failed for %s: %s", self.gateway_id, response)
                     return False
             else:
-                print(f"❌ Unexpected message from {self.gateway_id}: {challenge}")
+                logger.error("unexpected message from %s: %s", self.gateway_id, challenge)
                 return False
                 
         except Exception as e:
-            print(f"❌ Connection error for {self.gateway_id}: {e}")
+            logger.error("connection error for %s: %s", self.gateway_id, e)
             return False
     
     async def fetch_metadata(self):
@@ -145,7 +158,7 @@ class GatewayConnection:
                 self.models = models_res.get("payload", {}).get("models", [])
                 
         except Exception as e:
-            print(f"⚠️ Failed to fetch metadata for {self.gateway_id}: {e}")
+            logger.warning("failed to fetch metadata for %s: %s", self.gateway_id, e)
     
     async def request(self, method: str, params: Dict[str, Any]) -> Optional[Dict]:
         """Send a request and wait for response"""
@@ -153,43 +166,42 @@ class GatewayConnection:
             return None
         
         req_id = self.next_req_id()
-        future = asyncio.Future()
+        future = (self._loop or asyncio.get_running_loop()).create_future()
         self.pending_requests[req_id] = future
         
         request = {
             "type": "req",
-            "id": req_id,
+            "id": str(req_id),
             "method": method,
             "params": params
         }
         
         try:
-            await self.ws.send(json.dumps(request))
+            await self.ws.send(orjson.dumps(request).decode())
             # Wait for response with timeout
             response = await asyncio.wait_for(future, timeout=30.0)
             return response
         except asyncio.TimeoutError:
-            print(f"⚠️ Request {req_id} timed out")
-            self.pending_requests.pop(req_id, None)
+            logger.warning("request %s to %s timed out", req_id, self.gateway_id)
             return None
         except Exception as e:
-            print(f"❌ Request error: {e}")
-            self.pending_requests.pop(req_id, None)
+            logger.error("request error for %s: %s", self.gateway_id, e)
             return None
+        finally:
+            # Also covers callers cancelling us, e.g. via their own wait_for
+            self.pending_requests.pop(req_id, None)
     
     def on_event(self, event_type: str, handler: Callable):
         """Register event handler (supports multiple handlers per event)"""
-        if event_type not in self.event_handlers:
-            self.event_handlers[event_type] = []
-        self.event_handlers[event_type].append(handler)
+        # Handlers are stored as immutable tuples and swapped on change, so
+        # dispatch can iterate a snapshot while handlers come and go
+        self.event_handlers[event_type] = self.event_handlers.get(event_type, ()) + (handler,)
 
     def remove_event_handler(self, event_type: str, handler: Callable):
         """Remove a specific event handler"""
-        if event_type in self.event_handlers:
-            try:
-                self.event_handlers[event_type].remove(handler)
-            except ValueError:
-                pass
+        handlers = self.event_handlers.get(event_type)
+        if handlers and handler in handlers:
+            self.event_handlers[event_type] = tuple(h for h in handlers if h is not handler)
 
     def on_reconnect(self, callback: Callable):
         """Register callback for reconnection events"""
@@ -200,46 +212,46 @@ class GatewayConnection:
         while self.running and self.ws:
             try:
                 message = await self.ws.recv()
-                data = json.loads(message)
+                data = orjson.loads(message)
                 
                 msg_type = data.get("type")
                 
                 if msg_type == "res":
                     # Response to a request
-                    req_id = data.get("id")
-                    if req_id in self.pending_requests:
-                        future = self.pending_requests.pop(req_id)
-                        if not future.done():
-                            future.set_result(data)
+                    try:
+                        future = self.pending_requests.pop(int(data.get("id")), None)
+                    except (TypeError, ValueError):
+                        future = None
+                    if future and not future.done():
+                        future.set_result(data)
                 
                 elif msg_type == "event":
                     # Event from gateway - call all registered handlers
                     event = data.get("event")
-                    if event in self.event_handlers:
-                        for handler in self.event_handlers[event]:
-                            try:
-                                await handler(data.get("payload", {}))
-                            except Exception as e:
-                                print(f"⚠️ Event handler error for {event}: {e}")
+                    for handler in self.event_handlers.get(event, ()):
+                        try:
+                            await handler(data.get("payload", {}))
+                        except Exception as e:
+                            logger.warning("event handler error for %s: %s", event, e)
                 
             except websockets.exceptions.ConnectionClosed:
-                print(f"⚠️ Connection closed for {self.gateway_id}")
+                logger.warning("connection closed for %s", self.gateway_id)
                 self.connected = False
                 break
             except Exception as e:
-                print(f"❌ Listen error for {self.gateway_id}: {e}")
+                logger.error("listen error for %s: %s", self.gateway_id, e)
                 break
     
     async def reconnect_loop(self):
         """Auto-reconnect with exponential backoff"""
         while self.running:
             if not self.connected:
-                print(f"🔄 Attempting to reconnect {self.gateway_id} in {self.reconnect_delay}s")
+                logger.info("reconnecting %s in %ss", self.gateway_id, self.reconnect_delay)
                 await asyncio.sleep(self.reconnect_delay)
 
                 if await self.connect():
                     # Start listening again, then fetch metadata
-                    asyncio.create_task(self.listen())
+                    self._spawn(self.listen())
                     await self.fetch_metadata()
 
                     # Notify all reconnect callbacks
@@ -247,7 +259,7 @@ class GatewayConnection:
                         try:
                             await callback()
                         except Exception as e:
-                            print(f"⚠️ Reconnect callback error: {e}")
+                            logger.warning("reconnect callback error for %s: %s", self.gateway_id, e)
                 else:
                     # Increase backoff
                     self.reconnect_delay = min(self.reconnect_delay * 2, self.max_reconnect_delay)
@@ -257,20 +269,21 @@ class GatewayConnection:
     async def start(self):
         """Start the connection (non-blocking — reconnect loop handles retries)"""
         self.running = True
-        asyncio.create_task(self._start_connect())
+        self._loop = asyncio.get_running_loop()
+        self._spawn(self._start_connect())
     
     async def _start_connect(self):
         """Internal: attempt initial connect then start reconnect loop"""
         try:
             if await self.connect():
                 # Start listener FIRST so metadata requests get responses
-                asyncio.create_task(self.listen())
+                self._spawn(self.listen())
                 # Now fetch metadata
                 await self.fetch_metadata()
-            asyncio.create_task(self.reconnect_loop())
+            self._spawn(self.reconnect_loop())
         except Exception as e:
-            print(f"❌ Initial connect error for {self.gateway_id}: {e}")
-            asyncio.create_task(self.reconnect_loop())
+            logger.error("initial connect error for %s: %s", self.gateway_id, e)
+            self._spawn(self.reconnect_loop())
 
     async def stop(self):
         """Stop the connection"""
@@ -287,13 +300,35 @@ class GatewayManager:
     
     def __init__(self):
         self.connections: Dict[str, GatewayConnection] = {}
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}
+
+    def _spawner(self, gateway_id: str) -> Callable:
+        """Build a create_task wrapper that tracks tasks per gateway"""
+        tasks = self._tasks.setdefault(gateway_id, set())
+
+        def spawn(coro):
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            return task
+
+        return spawn
+
+    async def _cancel_tasks(self, gateway_id: str):
+        """Cancel listen/reconnect tasks belonging to a gateway"""
+        tasks = self._tasks.pop(gateway_id, set())
+        current = asyncio.current_task()
+        pending = [t for t in tasks if t is not current]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
     
     async def add_gateway(self, gateway_id: str, url: str, token: Optional[str] = None, password: Optional[str] = None):
         """Add and connect to a gateway"""
         if gateway_id in self.connections:
             await self.remove_gateway(gateway_id)
         
-        conn = GatewayConnection(gateway_id, url, token, password)
+        conn = GatewayConnection(gateway_id, url, token, password, spawn=self._spawner(gateway_id))
         self.connections[gateway_id] = conn
         await conn.start()
     
@@ -302,6 +337,7 @@ class GatewayManager:
         if gateway_id in self.connections:
             conn = self.connections.pop(gateway_id)
             await conn.stop()
+            await self._cancel_tasks(gateway_id)
     
     def get_connection(self, gateway_id: str) -> Optional[GatewayConnection]:
         """Get a gateway connection"""
@@ -311,6 +347,8 @@ class GatewayManager:
         """Stop all connections"""
         for conn in self.connections.values():
             await conn.stop()
+        for gateway_id in list(self._tasks):
+            await self._cancel_tasks(gateway_id)
         self.connections.clear()
 
 
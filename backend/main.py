@@ -1,24 +1,47 @@
+import logging
+import logging.handlers
+import queue
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database import init_db, get_db
+from database import init_db, db_pool, message_writer
 from gateway_manager import gateway_manager
-from config import settings
+from config import get_settings
+from pinger import pinger
 from routes import gateways, sessions, messages, ws, federated, devices
 
+settings = get_settings()
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route log records through a queue so handler I/O runs on a background thread"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s:     %(name)s - %(message)s"))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle manager for startup and shutdown"""
     # Startup
+    log_listener = setup_logging()
     print("🚀 Starting OpenClaw Chat Backend...")
     
     # Initialize database
     await init_db()
+    await db_pool.open()
+    app.state.db_pool = db_pool
+    message_writer.start()
     
     # Load and connect to existing gateways
-    db = await get_db()
-    try:
+    async with db_pool.connection() as db:
         cursor = await db.execute("SELECT id, url, token, password FROM gateways")
         rows = await cursor.fetchall()
         
@@ -29,8 +52,6 @@ async def lifespan(app: FastAPI):
                 row["token"],
                 row["password"]
             )
-    finally:
-        await db.close()
 
     # Start device polling
     devices.start_poller()
@@ -42,13 +63,20 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("🛑 Shutting down...")
     await gateway_manager.stop_all()
+    await devices.stop_poller()
+    await devices.close_ssh_connections()
+    pinger.close()
+    await message_writer.stop()
+    await db_pool.close()
     print("✅ Shutdown complete")
+    log_listener.stop()
 
 
 app = FastAPI(
     title="OpenClaw Chat Backend",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -81,3 +109,14 @@ async def root():
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Counters for tuning gateway RPC timeouts"""
+    return {
+        "gateway_rpc_failures": [
+            {"gateway_id": gateway_id, "method": method, "reason": reason, "count": count}
+            for (gateway_id, method, reason), count in sessions.rpc_failures.items()
+        ]
+    }
@@ -1,7 +1,18 @@
 from pydantic import BaseModel
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Type, TypeVar
 from datetime import datetime
 
+M = TypeVar("M", bound=BaseModel)
+
+
+def from_row(cls: Type[M], /, **fields) -> M:
+    """Build a response model from database values without validating them.
+
+    Rows come from our own schema, so re-checking every field would only
+    repeat what SQLite already enforces.
+    """
+    return cls.model_construct(**fields)
+
 
 # Gateway models
 class GatewayCreate(BaseModel):
@@ -43,6 +54,12 @@ class SessionCreate(BaseModel):
     model: Optional[str] = None
 
 
+class SessionContext(BaseModel):
+    contextTokens: Optional[int] = None
+    maxTokens: Optional[int] = None
+    percentage: Optional[float] = None
+
+
 class SessionResponse(BaseModel):
     id: int
     gateway_id: str
@@ -52,6 +69,7 @@ class SessionResponse(BaseModel):
     model: Optional[str] = None
     created_at: str
     last_activity: str
+    context: Optional[SessionContext] = None  # only with ?include_context=true
 
 
 # Message models
@@ -1,14 +1,24 @@
 import asyncio
+import logging
 import websockets
-import json
+import orjson
 import ipaddress
 import socket
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Tuple, AsyncIterator
 from urllib.parse import urlparse
 
+logger = logging.getLogger(__name__)
 
-def get_local_subnet() -> Optional[str]:
-    """Detect the local subnet by finding the primary network interface"""
+
+# Ranges that never host a gateway: "this" network, link-local, multicast, reserved
+_SKIP_RANGES = [
+    (int(net.network_address), int(net.broadcast_address))
+    for net in map(ipaddress.IPv4Network, ("0.0.0.0/8", "169.254.0.0/16", "224.0.0.0/4", "240.0.0.0/4"))
+]
+
+
+def get_local_subnet() -> Tuple[Optional[str], Optional[str]]:
+    """Detect the local subnet and IP by finding the primary network interface"""
     try:
         # Create a socket to determine the local IP
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -19,10 +29,38 @@ def get_local_subnet() -> Optional[str]:
 
         # Convert to network address with /24 subnet
         network = ipaddress.IPv4Network(f"{local_ip}/24", strict=False)
-        return str(network)
+        return str(network), local_ip
     except Exception as e:
-        print(f"⚠️ Failed to detect local subnet: {e}")
-        return None
+        logger.warning("failed to detect local subnet: %s", e)
+        return None, None
+
+
+def _host_range(network: ipaddress.IPv4Network) -> range:
+    """Host addresses of a network as integers"""
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.prefixlen < 31:
+        # Skip network and broadcast addresses
+        return range(first + 1, last)
+    return range(first, last + 1)
+
+
+def _is_reserved(ip_int: int) -> bool:
+    return any(lo <= ip_int <= hi for lo, hi in _SKIP_RANGES)
+
+
+async def port_open(ip: str, port: int, timeout: float = 0.1) -> bool:
+    """Cheap TCP connect check used to skip hosts that aren't listening"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+    except Exception:
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return True
 
 
 async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Optional[Dict[str, Any]]:
@@ -32,6 +70,10 @@ async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Opt
     """
     url = f"ws://{ip}:{port}"
 
+    # Most hosts aren't listening at all; don't attempt a WebSocket handshake for them
+    if not await port_open(ip, port):
+        return None
+
     try:
         # Try to connect with timeout
         ws = await asyncio.wait_for(
@@ -42,7 +84,7 @@ async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Opt
         try:
             # Wait for connect.challenge with timeout
             challenge_msg = await asyncio.wait_for(ws.recv(), timeout=timeout)
-            challenge = json.loads(challenge_msg)
+            challenge = orjson.loads(challenge_msg)
 
             # Verify it's a valid OpenClaw gateway
             if challenge.get("type") == "event" and challenge.get("event") == "connect.challenge":
@@ -71,11 +113,11 @@ async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Opt
                 # Strip None values
                 connect_req["params"] = {k: v for k, v in connect_req["params"].items() if v is not None}
 
-                await ws.send(json.dumps(connect_req))
+                await ws.send(orjson.dumps(connect_req).decode())
 
                 # Wait for response
                 response_msg = await asyncio.wait_for(ws.recv(), timeout=timeout)
-                response = json.loads(response_msg)
+                response = orjson.loads(response_msg)
 
                 if response.get("ok"):
                     # Extract useful metadata
@@ -96,7 +138,7 @@ async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Opt
             await ws.close()
             return None
 
-        except (asyncio.TimeoutError, json.JSONDecodeError, KeyError):
+        except (asyncio.TimeoutError, orjson.JSONDecodeError, KeyError):
             await ws.close()
             return None
 
@@ -104,53 +146,88 @@ async def probe_gateway(ip: str, port: int = 18789, timeout: float = 2.0) -> Opt
         # Connection failed, timeout, or not a WebSocket server
         return None
     except Exception as e:
-        print(f"⚠️ Unexpected error probing {ip}: {e}")
+        logger.warning("unexpected error probing %s: %s", ip, e)
         return None
 
 
-async def scan_network(subnet: Optional[str] = None, port: int = 18789, max_concurrent: int = 50) -> List[Dict[str, Any]]:
+async def discover_gateways(
+    subnet: Optional[str] = None,
+    port: int = 18789,
+    max_concurrent: int = 512,
+    exclude: Optional[Iterable[str]] = None
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Scan the local network for OpenClaw gateways.
+    Scan the local network for OpenClaw gateways, yielding each one as soon as it answers.
 
     Args:
         subnet: Network subnet in CIDR notation (e.g., "192.168.1.0/24"). Auto-detected if None.
         port: Port to scan (default: 18789)
         max_concurrent: Maximum number of concurrent connections
+        exclude: Addresses to skip, e.g. gateways that are already configured
 
-    Returns:
-        List of discovered gateway metadata dictionaries
+    Yields:
+        Discovered gateway metadata dictionaries. Probes still in flight are
+        cancelled when the consumer stops iterating.
     """
+    detected_subnet, local_ip = get_local_subnet()
+
     # Auto-detect subnet if not provided
     if subnet is None:
-        subnet = get_local_subnet()
+        subnet = detected_subnet
         if subnet is None:
-            print("❌ Could not detect local subnet")
-            return []
+            logger.error("could not detect local subnet")
+            return
 
-    print(f"🔍 Scanning network {subnet} on port {port}...")
+    logger.info("scanning network %s on port %s", subnet, port)
 
-    # Generate list of IPs to scan
     try:
         network = ipaddress.IPv4Network(subnet, strict=False)
-        # Skip network and broadcast addresses
-        ips = [str(ip) for ip in network.hosts()]
     except ValueError as e:
-        print(f"❌ Invalid subnet: {e}")
-        return []
+        logger.error("invalid subnet: %s", e)
+        return
 
-    discovered = []
+    # Never probe ourselves or hosts we already know about
+    skip = set()
+    for addr in (local_ip, *(exclude or ())):
+        try:
+            skip.add(int(ipaddress.IPv4Address(addr)))
+        except (ipaddress.AddressValueError, ValueError):
+            pass  # hostnames and missing values can't be matched against IPs
+
+    # Scan wide subnets one /24 at a time so the number of open sockets stays bounded
+    waves = list(network.subnets(new_prefix=24)) if network.prefixlen < 24 else [network]
+
+    found = 0
     semaphore = asyncio.Semaphore(max_concurrent)
 
-    async def probe_with_semaphore(ip: str) -> Optional[Dict[str, Any]]:
+    async def probe_with_semaphore(ip_int: int) -> Optional[Dict[str, Any]]:
         async with semaphore:
-            return await probe_gateway(ip, port)
+            return await probe_gateway(socket.inet_ntoa(ip_int.to_bytes(4, "big")), port)
 
-    # Scan all IPs concurrently (limited by semaphore)
-    tasks = [probe_with_semaphore(ip) for ip in ips]
-    results = await asyncio.gather(*tasks)
+    for wave in waves:
+        ips = [ip for ip in _host_range(wave) if ip not in skip and not _is_reserved(ip)]
 
-    # Filter out None results
-    discovered = [r for r in results if r is not None]
-
-    print(f"✅ Scan complete. Found {len(discovered)} gateway(s)")
-    return discovered
+        # Scan the wave concurrently (limited by semaphore), reporting hits as they land
+        tasks = [asyncio.create_task(probe_with_semaphore(ip)) for ip in ips]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result is not None:
+                    found += 1
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    logger.info("scan complete, found %d gateway(s)", found)
+
+
+async def scan_network(
+    subnet: Optional[str] = None,
+    port: int = 18789,
+    max_concurrent: int = 512,
+    exclude: Optional[Iterable[str]] = None
+) -> List[Dict[str, Any]]:
+    """Scan the local network and return every gateway found (see discover_gateways)"""
+    return [gw async for gw in discover_gateways(subnet, port, max_concurrent, exclude)]
@@ -0,0 +1,101 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import struct
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# ICMP echo request/reply types and the payload sent with each request
+_ECHO_REQUEST = 8
+_ECHO_REPLY = 0
+_PAYLOAD = b"openclaw-ping"
+
+
+class IcmpPinger:
+    """Sends ICMP echoes over one shared unprivileged datagram socket (IPv4).
+
+    Every outstanding ping is a future keyed by (address, sequence number); a
+    single reader callback on the event loop resolves them as replies arrive.
+    On Linux the kernel fills in the echo id and checksum for datagram ICMP
+    sockets, which needs net.ipv4.ping_group_range to include our group.
+    """
+
+    def __init__(self):
+        self._sock: Optional[socket.socket] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._seq = 0
+
+    def _open(self):
+        # Raises PermissionError when unprivileged ICMP sockets aren't allowed
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+        self._sock = sock
+
+    def close(self):
+        """Close the socket and fail any pings still waiting"""
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+    async def ping(self, host: str, timeout: float = 2.0) -> bool:
+        """Send one echo request; True if a reply arrives within `timeout` seconds"""
+        if self._sock is None:
+            self._open()
+
+        try:
+            address = str(ipaddress.IPv4Address(host))
+        except ipaddress.AddressValueError:
+            infos = await self._loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            address = infos[0][4][0]
+
+        self._seq = (self._seq + 1) & 0xFFFF
+        key = (address, self._seq)
+        future = self._loop.create_future()
+        self._pending[key] = future
+        try:
+            # id and checksum are left zero for the kernel to fill in
+            packet = struct.pack("!BBHHH", _ECHO_REQUEST, 0, 0, 0, self._seq) + _PAYLOAD
+            self._sock.sendto(packet, (address, 0))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._pending.pop(key, None)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, (address, _) = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # e.g. an ICMP error queued for an earlier echo; keep reading
+                logger.debug("ICMP receive error: %s", e)
+                continue
+
+            # Some platforms (macOS) include the IP header on datagram ICMP sockets
+            if data and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8 or data[0] != _ECHO_REPLY:
+                continue
+
+            seq = struct.unpack_from("!H", data, 6)[0]
+            future = self._pending.get((address, seq))
+            if future is not None and not future.done():
+                future.set_result(True)
+
+
+# Shared pinger for device status checks
+pinger = IcmpPinger()
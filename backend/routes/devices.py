@@ -1,29 +1,132 @@
 from fastapi import APIRouter, HTTPException
-from typing import List
-from models import DeviceCreate, DeviceResponse, DeviceStatusResponse, ServiceStatus
-from database import get_db
-import json
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional, Set, Tuple
+from models import DeviceCreate, DeviceResponse, DeviceStatusResponse, ServiceStatus, from_row
+from database import db_pool
+import aiosqlite
+import orjson
 import asyncio
-import subprocess
+import logging
+import asyncssh
+import shlex
+import time
 from datetime import datetime
+from pinger import pinger
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/devices", tags=["devices"])
 
-# Module-level cache for device statuses
-_status_cache = {}
+# Module-level cache for device statuses: device id -> (status, expiry on the monotonic clock)
+_status_cache: Dict[str, Tuple[DeviceStatusResponse, float]] = {}
+# Bumped whenever a device changes, so checks started before the change aren't cached
+_status_generation: Dict[str, int] = {}
 _poller_task = None
+_poller_restart: Optional[asyncio.TimerHandle] = None
+
+# Seconds between poll cycles, and how long a status stays fresh
+POLL_INTERVAL = 60
+STATUS_TTL = 90
+
+# Delay before restarting a poller that crashed
+POLLER_RESTART_DELAY = 5
+
+# Maximum number of devices checked at the same time
+POLL_CONCURRENCY = 32
+
+# Live status subscribers (one queue of pre-encoded SSE events per client)
+_subscribers: Set[asyncio.Queue] = set()
+SUBSCRIBER_QUEUE_SIZE = 64
+SSE_HEARTBEAT = 15
+
+# Long-lived SSH connections for service checks, keyed by (host, user, port)
+_ssh_pool: Dict[Tuple[str, str, int], asyncssh.SSHClientConnection] = {}
+# Connections being opened, so concurrent misses for one key share a single connect
+_ssh_connecting: Dict[Tuple[str, str, int], asyncio.Future] = {}
+
+# Cleared when the OS doesn't allow unprivileged ICMP sockets (net.ipv4.ping_group_range)
+_icmp_sockets_allowed = True
+
+
+async def _run_command(args: List[str], timeout: float, capture: bool = False):
+    """Run a command without blocking the event loop; returns (returncode, stdout)"""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise TimeoutError(f"{args[0]} timed out after {timeout}s")
+    return proc.returncode, (stdout or b"").decode(errors="replace")
+
+
+async def _ping(ip: str) -> bool:
+    """Send one ICMP echo over the shared socket, falling back to the ping binary"""
+    global _icmp_sockets_allowed
+    if _icmp_sockets_allowed:
+        try:
+            return await pinger.ping(ip, timeout=2)
+        except PermissionError:
+            logger.warning("ICMP sockets not permitted, falling back to the ping command")
+            _icmp_sockets_allowed = False
+
+    returncode, _ = await _run_command(["ping", "-c", "1", "-W", "2", ip], timeout=3)
+    return returncode == 0
+
+
+async def _ssh_connect(key: Tuple[str, str, int]) -> asyncssh.SSHClientConnection:
+    """Open and pool a connection for `key`; concurrent callers share one attempt"""
+    task = _ssh_connecting.get(key)
+    if task is None:
+        ip, ssh_user, ssh_port = key
+
+        async def connect():
+            # Host keys aren't checked, same as the former `ssh -o StrictHostKeyChecking=no`
+            conn = await asyncssh.connect(ip, port=ssh_port, username=ssh_user, known_hosts=None, connect_timeout=5)
+            _ssh_pool[key] = conn
+            return conn
+
+        task = asyncio.ensure_future(connect())
+        _ssh_connecting[key] = task
+        task.add_done_callback(lambda _: _ssh_connecting.pop(key, None))
+    # Shielded so one caller going away doesn't cancel it for the rest
+    return await asyncio.shield(task)
+
+
+async def _ssh_run(ip: str, ssh_user: str, ssh_port: int, command: str, timeout: float = 10):
+    """Run a command over a pooled SSH connection, reconnecting lazily after failures"""
+    key = (ip, ssh_user, ssh_port)
+    conn = _ssh_pool.get(key)
+    if conn is None or conn.is_closed():
+        conn = await _ssh_connect(key)
+    try:
+        return await asyncio.wait_for(conn.run(command, check=False), timeout)
+    except Exception:
+        _ssh_pool.pop(key, None)
+        conn.close()
+        raise
+
+
+async def close_ssh_connections():
+    """Close all pooled SSH connections"""
+    for task in list(_ssh_connecting.values()):
+        task.cancel()
+    conns = list(_ssh_pool.values())
+    _ssh_pool.clear()
+    for conn in conns:
+        conn.close()
+    await asyncio.gather(*(conn.wait_closed() for conn in conns), return_exceptions=True)
 
 
 async def check_device_status(device_id: str, ip: str, ssh_user: str, ssh_port: int, services: List[str]) -> DeviceStatusResponse:
     """Check device status via ping and SSH service checks"""
     # Ping check
     try:
-        result = subprocess.run(
-            ["ping", "-c", "1", "-W", "2", ip],
-            capture_output=True,
-            timeout=3
-        )
-        online = result.returncode == 0
+        online = await _ping(ip)
     except Exception as e:
         return DeviceStatusResponse(
             id=device_id,
@@ -49,33 +152,25 @@ async def check_device_status(device_id: str, ip: str, ssh_user: str, ssh_port:
     # SSH service checks
     service_statuses = []
     if ssh_user and services:
-        for service in services:
-            try:
-                result = subprocess.run(
-                    [
-                        "ssh",
-                        "-o", "ConnectTimeout=5",
-                        "-o", "StrictHostKeyChecking=no",
-                        "-p", str(ssh_port),
-                        f"{ssh_user}@{ip}",
-                        f"systemctl is-active {service}"
-                    ],
-                    capture_output=True,
-                    timeout=10,
-                    text=True
-                )
-                active = result.returncode == 0 and result.stdout.strip() == "active"
+        # One round trip for all services: systemctl prints one state per unit, in order.
+        # A nonzero exit only means some unit isn't active, so it isn't treated as an error.
+        command = "systemctl is-active " + " ".join(shlex.quote(service) for service in services)
+        try:
+            result = await _ssh_run(ip, ssh_user, ssh_port, command)
+            states = str(result.stdout or "").strip().splitlines()
+            for i, service in enumerate(services):
+                state = states[i].strip() if i < len(states) else "unknown"
+                active = state == "active"
                 service_statuses.append(ServiceStatus(
                     name=service,
                     active=active,
-                    error=None if active else result.stdout.strip()
-                ))
-            except Exception as e:
-                service_statuses.append(ServiceStatus(
-                    name=service,
-                    active=False,
-                    error=str(e)
+                    error=None if active else state
                 ))
+        except Exception as e:
+            service_statuses = [
+                ServiceStatus(name=service, active=False, error=str(e))
+                for service in services
+            ]
 
     return DeviceStatusResponse(
         id=device_id,
@@ -88,49 +183,113 @@ async def check_device_status(device_id: str, ip: str, ssh_user: str, ssh_port:
     )
 
 
+def _cached_status(device_id: str) -> Optional[DeviceStatusResponse]:
+    """Cached status for a device, or None if missing or expired"""
+    entry = _status_cache.get(device_id)
+    if entry is None or time.monotonic() > entry[1]:
+        return None
+    return entry[0]
+
+
+def _invalidate_status(device_id: str):
+    """Forget a device's status after its configuration changed"""
+    _status_cache.pop(device_id, None)
+    _status_generation[device_id] = _status_generation.get(device_id, 0) + 1
+
+
+def _publish(event: str):
+    """Fan an SSE event out to every subscriber, dropping the oldest for slow ones"""
+    for queue in _subscribers:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+def _status_event(status: DeviceStatusResponse) -> str:
+    return f"data: {status.model_dump_json()}\n\n"
+
+
+async def _refresh_status(row) -> DeviceStatusResponse:
+    """Check a device now and cache the result"""
+    generation = _status_generation.get(row["id"], 0)
+    services = orjson.loads(row["services"]) if row["services"] else []
+    status = await check_device_status(
+        row["id"],
+        row["ip"],
+        row["ssh_user"],
+        row["ssh_port"],
+        services
+    )
+    # Labelled before it is cached; cached statuses are never mutated afterwards
+    status.name = row["name"]
+    status.icon = row["icon"]
+    if _status_generation.get(row["id"], 0) == generation:
+        _status_cache[row["id"]] = (status, time.monotonic() + STATUS_TTL)
+        if _subscribers:
+            _publish(_status_event(status))
+    return status
+
+
 async def poll_devices():
     """Background task to poll all enabled devices every 60 seconds"""
     while True:
         try:
-            db = await get_db()
-            try:
+            async with db_pool.connection() as db:
                 cursor = await db.execute(
                     "SELECT id, name, ip, icon, ssh_user, ssh_port, services FROM devices WHERE enabled = 1"
                 )
                 rows = await cursor.fetchall()
 
-                for row in rows:
-                    services = json.loads(row["services"]) if row["services"] else []
-                    status = await check_device_status(
-                        row["id"],
-                        row["ip"],
-                        row["ssh_user"],
-                        row["ssh_port"],
-                        services
-                    )
-                    status.name = row["name"]
-                    status.icon = row["icon"]
-                    _status_cache[row["id"]] = status
-            finally:
-                await db.close()
+            # Checks can take seconds, so run them without holding a pooled connection
+            semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+            async def poll_one(row):
+                async with semaphore:
+                    await _refresh_status(row)
+
+            results = await asyncio.gather(*(poll_one(row) for row in rows), return_exceptions=True)
+            for row, result in zip(rows, results):
+                if isinstance(result, Exception):
+                    logger.warning("error polling device %s: %s", row["id"], result)
         except Exception as e:
-            print(f"Error polling devices: {e}")
+            logger.error("error polling devices: %s", e)
 
-        await asyncio.sleep(60)
+        await asyncio.sleep(POLL_INTERVAL)
 
 
 def start_poller():
     """Start the background poller"""
     global _poller_task
-    if _poller_task is None:
+    if _poller_task is None or _poller_task.done():
         _poller_task = asyncio.create_task(poll_devices())
+        _poller_task.add_done_callback(_restart_poller)
+
+
+def _restart_poller(task: asyncio.Task):
+    """Respawn the poller if it died, so statuses don't silently go stale"""
+    if task.cancelled():
+        return
+    global _poller_restart
+    logger.error("device poller stopped (%r), restarting in %ss", task.exception(), POLLER_RESTART_DELAY)
+    _poller_restart = asyncio.get_running_loop().call_later(POLLER_RESTART_DELAY, start_poller)
+
+
+async def stop_poller():
+    """Cancel the background poller (and any pending restart)"""
+    global _poller_task, _poller_restart
+    if _poller_restart is not None:
+        _poller_restart.cancel()
+        _poller_restart = None
+    task, _poller_task = _poller_task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
 
 
 @router.get("", response_model=List[DeviceResponse])
 async def list_devices():
     """List all devices"""
-    db = await get_db()
-    try:
+    async with db_pool.connection() as db:
         cursor = await db.execute(
             "SELECT id, name, ip, icon, enabled, ssh_user, ssh_port, services, created_at FROM devices ORDER BY created_at"
         )
@@ -138,8 +297,9 @@ async def list_devices():
 
         devices = []
         for row in rows:
-            services = json.loads(row["services"]) if row["services"] else []
-            devices.append(DeviceResponse(
+            services = orjson.loads(row["services"]) if row["services"] else []
+            devices.append(from_row(
+                DeviceResponse,
                 id=row["id"],
                 name=row["name"],
                 ip=row["ip"],
@@ -152,46 +312,39 @@ async def list_devices():
             ))
 
         return devices
-    finally:
-        await db.close()
 
 
 @router.post("", response_model=DeviceResponse)
 async def create_device(device: DeviceCreate):
     """Create a new device"""
-    db = await get_db()
-    try:
-        # Check if device already exists
-        cursor = await db.execute("SELECT id FROM devices WHERE id = ?", (device.id,))
-        if await cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Device with this ID already exists")
-
-        await db.execute(
-            """
-            INSERT INTO devices (id, name, ip, icon, enabled, ssh_user, ssh_port, services)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                device.id,
-                device.name,
-                device.ip,
-                device.icon,
-                1 if device.enabled else 0,
-                device.ssh_user,
-                device.ssh_port,
-                json.dumps(device.services)
+    async with db_pool.writer() as db:
+        # The primary key rejects duplicates, so no existence check is needed
+        try:
+            cursor = await db.execute(
+                """
+                INSERT INTO devices (id, name, ip, icon, enabled, ssh_user, ssh_port, services)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id, name, ip, icon, enabled, ssh_user, ssh_port, services, created_at
+                """,
+                (
+                    device.id,
+                    device.name,
+                    device.ip,
+                    device.icon,
+                    1 if device.enabled else 0,
+                    device.ssh_user,
+                    device.ssh_port,
+                    orjson.dumps(device.services).decode()
+                )
             )
-        )
-        await db.commit()
-
-        # Fetch the created device
-        cursor = await db.execute(
-            "SELECT id, name, ip, icon, enabled, ssh_user, ssh_port, services, created_at FROM devices WHERE id = ?",
-            (device.id,)
-        )
-        row = await cursor.fetchone()
+            row = await cursor.fetchone()
+            await db.commit()
+        except aiosqlite.IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Device with this ID already exists")
+        _invalidate_status(device.id)
 
-        services = json.loads(row["services"]) if row["services"] else []
+        services = orjson.loads(row["services"]) if row["services"] else []
         return DeviceResponse(
             id=row["id"],
             name=row["name"],
@@ -203,20 +356,18 @@ async def create_device(device: DeviceCreate):
             services=services,
             created_at=row["created_at"]
         )
-    finally:
-        await db.close()
 
 
 @router.put("/{device_id}", response_model=DeviceResponse)
 async def update_device(device_id: str, device: DeviceCreate):
     """Update a device"""
-    db = await get_db()
-    try:
-        await db.execute(
+    async with db_pool.writer() as db:
+        cursor = await db.execute(
             """
             UPDATE devices
             SET name = ?, ip = ?, icon = ?, enabled = ?, ssh_user = ?, ssh_port = ?, services = ?
             WHERE id = ?
+            RETURNING id, name, ip, icon, enabled, ssh_user, ssh_port, services, created_at
             """,
             (
                 device.name,
@@ -225,23 +376,18 @@ async def update_device(device_id: str, device: DeviceCreate):
                 1 if device.enabled else 0,
                 device.ssh_user,
                 device.ssh_port,
-                json.dumps(device.services),
+                orjson.dumps(device.services).decode(),
                 device_id
             )
         )
-        await db.commit()
-
-        # Fetch the updated device
-        cursor = await db.execute(
-            "SELECT id, name, ip, icon, enabled, ssh_user, ssh_port, services, created_at FROM devices WHERE id = ?",
-            (device_id,)
-        )
         row = await cursor.fetchone()
+        await db.commit()
 
         if not row:
             raise HTTPException(status_code=404, detail="Device not found")
+        _invalidate_status(device_id)
 
-        services = json.loads(row["services"]) if row["services"] else []
+        services = orjson.loads(row["services"]) if row["services"] else []
         return DeviceResponse(
             id=row["id"],
             name=row["name"],
@@ -253,36 +399,27 @@ async def update_device(device_id: str, device: DeviceCreate):
             services=services,
             created_at=row["created_at"]
         )
-    finally:
-        await db.close()
 
 
 @router.delete("/{device_id}")
 async def delete_device(device_id: str):
     """Delete a device"""
-    db = await get_db()
-    try:
-        cursor = await db.execute("SELECT id FROM devices WHERE id = ?", (device_id,))
-        if not await cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Device not found")
-
-        await db.execute("DELETE FROM devices WHERE id = ?", (device_id,))
+    async with db_pool.writer() as db:
+        cursor = await db.execute("DELETE FROM devices WHERE id = ?", (device_id,))
         await db.commit()
-
-        # Remove from cache
-        if device_id in _status_cache:
-            del _status_cache[device_id]
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Device not found")
+        _invalidate_status(device_id)
+        if _subscribers:
+            _publish(f"event: removed\ndata: {orjson.dumps({'id': device_id}).decode()}\n\n")
 
         return {"status": "deleted"}
-    finally:
-        await db.close()
 
 
 @router.get("/status", response_model=List[DeviceStatusResponse])
 async def get_device_statuses():
     """Get status for all enabled devices"""
-    db = await get_db()
-    try:
+    async with db_pool.connection() as db:
         cursor = await db.execute(
             "SELECT id, name, icon FROM devices WHERE enabled = 1 ORDER BY created_at"
         )
@@ -290,13 +427,12 @@ async def get_device_statuses():
 
         statuses = []
         for row in rows:
-            if row["id"] in _status_cache:
-                status = _status_cache[row["id"]]
-                status.name = row["name"]
-                status.icon = row["icon"]
-                statuses.append(status)
+            status = _cached_status(row["id"])
+            if status is not None:
+                # Cached entries are shared, so label a copy
+                statuses.append(status.model_copy(update={"name": row["name"], "icon": row["icon"]}))
             else:
-                # Return offline status if not in cache yet
+                # Return offline status until the next check
                 statuses.append(DeviceStatusResponse(
                     id=row["id"],
                     name=row["name"],
@@ -308,42 +444,53 @@ async def get_device_statuses():
                 ))
 
         return statuses
-    finally:
-        await db.close()
+
+
+@router.get("/status/stream")
+async def stream_device_statuses():
+    """
+    Push device statuses as Server-Sent Events.
+    Starts with every fresh cached status, then sends each new check result as
+    the poller produces it, plus a `removed` event when a device is deleted.
+    A comment line is sent every SSE_HEARTBEAT seconds to keep proxies from
+    closing an idle stream.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    async def events():
+        _subscribers.add(queue)
+        try:
+            for device_id in list(_status_cache):
+                status = _cached_status(device_id)
+                if status is not None:
+                    yield _status_event(status)
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            _subscribers.discard(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @router.get("/{device_id}/status", response_model=DeviceStatusResponse)
 async def get_device_status(device_id: str):
     """Get status for a specific device"""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
+    async with db_pool.connection() as db:
+        rows = await db.execute_fetchall(
             "SELECT id, name, icon, ip, ssh_user, ssh_port, services FROM devices WHERE id = ? AND enabled = 1",
             (device_id,)
         )
-        row = await cursor.fetchone()
+    row = rows[0] if rows else None
 
-        if not row:
-            raise HTTPException(status_code=404, detail="Device not found or disabled")
-
-        if device_id in _status_cache:
-            status = _status_cache[device_id]
-            status.name = row["name"]
-            status.icon = row["icon"]
-            return status
-        else:
-            # Perform immediate check
-            services = json.loads(row["services"]) if row["services"] else []
-            status = await check_device_status(
-                row["id"],
-                row["ip"],
-                row["ssh_user"],
-                row["ssh_port"],
-                services
-            )
-            status.name = row["name"]
-            status.icon = row["icon"]
-            _status_cache[device_id] = status
-            return status
-    finally:
-        await db.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="Device not found or disabled")
+
+    status = _cached_status(device_id)
+    if status is not None:
+        return status.model_copy(update={"name": row["name"], "icon": row["icon"]})
+
+    # Perform immediate check
+    return await _refresh_status(row)
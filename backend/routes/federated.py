@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from typing import List
-from models import FederatedSessionCreate, FederatedSessionResponse, FederatedSessionGateway
-from database import get_db
+from models import FederatedSessionCreate, FederatedSessionResponse, FederatedSessionGateway, from_row
+from database import db_pool
 import uuid
 
 router = APIRouter(prefix="/api/federated-sessions", tags=["federated"])
@@ -10,96 +10,85 @@ router = APIRouter(prefix="/api/federated-sessions", tags=["federated"])
 @router.post("", response_model=FederatedSessionResponse)
 async def create_federated_session(session: FederatedSessionCreate):
     """Create a new federated session"""
-    db = await get_db()
-    try:
-        session_id = str(uuid.uuid4())
-
-        # Insert federated session
-        await db.execute(
-            "INSERT INTO federated_sessions (id, title) VALUES (?, ?)",
-            (session_id, session.title)
-        )
+    async with db_pool.writer() as db:
+        try:
+            session_id = str(uuid.uuid4())
+
+            # Take the write lock up front; everything below is one transaction
+            await db.execute("BEGIN IMMEDIATE")
+
+            # Insert federated session
+            cursor = await db.execute(
+                "INSERT INTO federated_sessions (id, title) VALUES (?, ?) RETURNING created_at, last_activity",
+                (session_id, session.title)
+            )
+            row = await cursor.fetchone()
 
-        # Insert gateway associations
-        for gw in session.gateways:
-            await db.execute(
+            # Insert gateway associations (statement prepared once)
+            await db.executemany(
                 "INSERT INTO federated_session_gateways (federated_session_id, gateway_id, session_key) VALUES (?, ?, ?)",
-                (session_id, gw.gateway_id, gw.session_key)
+                [(session_id, gw.gateway_id, gw.session_key) for gw in session.gateways]
             )
 
-        await db.commit()
+            await db.commit()
 
-        # Fetch created session
-        cursor = await db.execute(
-            "SELECT id, title, created_at, last_activity FROM federated_sessions WHERE id = ?",
-            (session_id,)
-        )
-        row = await cursor.fetchone()
-
-        return FederatedSessionResponse(
-            id=row["id"],
-            title=row["title"],
-            gateways=session.gateways,
-            created_at=row["created_at"],
-            last_activity=row["last_activity"]
-        )
-    except Exception as e:
-        await db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        await db.close()
+            return FederatedSessionResponse(
+                id=session_id,
+                title=session.title,
+                gateways=session.gateways,
+                created_at=row["created_at"],
+                last_activity=row["last_activity"]
+            )
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("", response_model=List[FederatedSessionResponse])
 async def list_federated_sessions():
     """List all federated sessions"""
-    db = await get_db()
-    try:
+    async with db_pool.connection() as db:
+        # One query for sessions and their gateways, grouped below
         cursor = await db.execute(
-            "SELECT id, title, created_at, last_activity FROM federated_sessions ORDER BY last_activity DESC"
+            """SELECT s.id, s.title, s.created_at, s.last_activity, g.gateway_id, g.session_key
+               FROM federated_sessions s
+               LEFT JOIN federated_session_gateways g ON g.federated_session_id = s.id
+               ORDER BY s.last_activity DESC"""
         )
         rows = await cursor.fetchall()
 
-        sessions = []
-        for row in rows:
-            # Fetch associated gateways
-            gw_cursor = await db.execute(
-                "SELECT gateway_id, session_key FROM federated_session_gateways WHERE federated_session_id = ?",
-                (row["id"],)
-            )
-            gw_rows = await gw_cursor.fetchall()
-
-            gateways = [
-                FederatedSessionGateway(gateway_id=gw["gateway_id"], session_key=gw["session_key"])
-                for gw in gw_rows
-            ]
-
-            sessions.append(FederatedSessionResponse(
+    sessions = {}
+    for row in rows:
+        session = sessions.get(row["id"])
+        if session is None:
+            session = sessions[row["id"]] = from_row(
+                FederatedSessionResponse,
                 id=row["id"],
                 title=row["title"],
-                gateways=gateways,
+                gateways=[],
                 created_at=row["created_at"],
                 last_activity=row["last_activity"]
-            ))
+            )
+        if row["gateway_id"] is not None:
+            session.gateways.append(
+                from_row(FederatedSessionGateway, gateway_id=row["gateway_id"], session_key=row["session_key"])
+            )
 
-        return sessions
-    finally:
-        await db.close()
+    return list(sessions.values())
 
 
 @router.get("/{session_id}", response_model=FederatedSessionResponse)
 async def get_federated_session(session_id: str):
     """Get a specific federated session"""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
+    async with db_pool.connection() as db:
+        rows = await db.execute_fetchall(
             "SELECT id, title, created_at, last_activity FROM federated_sessions WHERE id = ?",
             (session_id,)
         )
-        row = await cursor.fetchone()
 
-        if not row:
+        if not rows:
             raise HTTPException(status_code=404, detail="Federated session not found")
+        row = rows[0]
 
         # Fetch associated gateways
         gw_cursor = await db.execute(
@@ -120,19 +109,14 @@ async def get_federated_session(session_id: str):
             created_at=row["created_at"],
             last_activity=row["last_activity"]
         )
-    finally:
-        await db.close()
 
 
 @router.delete("/{session_id}")
 async def delete_federated_session(session_id: str):
     """Delete a federated session"""
-    db = await get_db()
-    try:
+    async with db_pool.writer() as db:
         await db.execute("DELETE FROM federated_session_gateways WHERE federated_session_id = ?", (session_id,))
         await db.execute("DELETE FROM federated_sessions WHERE id = ?", (session_id,))
         await db.commit()
 
         return {"ok": True}
-    finally:
-        await db.close()
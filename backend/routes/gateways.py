@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List
 from models import GatewayCreate, GatewayResponse, GatewayStatus, DiscoveredGateway
-from database import get_db
+from database import db_pool, session_ids
 from gateway_manager import gateway_manager
-from network_scanner import scan_network
+from network_scanner import scan_network, discover_gateways
+from urllib.parse import urlparse
 
 router = APIRouter(prefix="/api/gateways", tags=["gateways"])
 
@@ -11,8 +13,7 @@ router = APIRouter(prefix="/api/gateways", tags=["gateways"])
 @router.get("", response_model=List[GatewayResponse])
 async def list_gateways():
     """List all gateways (tokens omitted)"""
-    db = await get_db()
-    try:
+    async with db_pool.connection() as db:
         cursor = await db.execute("SELECT id, name, url, created_at FROM gateways")
         rows = await cursor.fetchall()
         
@@ -28,55 +29,57 @@ async def list_gateways():
             ))
         
         return gateways
-    finally:
-        await db.close()
 
 
 @router.post("", response_model=GatewayResponse)
 async def add_gateway(gateway: GatewayCreate):
     """Add a new gateway"""
-    db = await get_db()
-    try:
-        # Insert into database
-        await db.execute(
-            "INSERT INTO gateways (id, name, url, token, password) VALUES (?, ?, ?, ?, ?)",
-            (gateway.id, gateway.name, gateway.url, gateway.token, gateway.password)
-        )
-        await db.commit()
-        
-        # Connect to gateway
-        await gateway_manager.add_gateway(gateway.id, gateway.url, gateway.token, gateway.password)
-        
-        conn = gateway_manager.get_connection(gateway.id)
-        
-        return GatewayResponse(
-            id=gateway.id,
-            name=gateway.name,
-            url=gateway.url,
-            connected=conn.connected if conn else False
-        )
-    except Exception as e:
-        await db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        await db.close()
+    async with db_pool.writer() as db:
+        try:
+            # Insert into database
+            await db.execute(
+                "INSERT INTO gateways (id, name, url, token, password) VALUES (?, ?, ?, ?, ?)",
+                (gateway.id, gateway.name, gateway.url, gateway.token, gateway.password)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Connect to gateway
+    await gateway_manager.add_gateway(gateway.id, gateway.url, gateway.token, gateway.password)
+
+    conn = gateway_manager.get_connection(gateway.id)
+
+    return GatewayResponse(
+        id=gateway.id,
+        name=gateway.name,
+        url=gateway.url,
+        connected=conn.connected if conn else False
+    )
 
 
 @router.delete("/{gateway_id}")
 async def delete_gateway(gateway_id: str):
     """Delete a gateway"""
-    db = await get_db()
-    try:
+    async with db_pool.writer() as db:
+        # Remove dependent rows first (foreign keys are enforced)
+        await db.execute(
+            "DELETE FROM messages WHERE session_id IN (SELECT id FROM sessions WHERE gateway_id = ?)",
+            (gateway_id,)
+        )
+        await db.execute("DELETE FROM sessions WHERE gateway_id = ?", (gateway_id,))
+        await db.execute("DELETE FROM federated_session_gateways WHERE gateway_id = ?", (gateway_id,))
+
         # Remove from database
         await db.execute("DELETE FROM gateways WHERE id = ?", (gateway_id,))
         await db.commit()
-        
-        # Disconnect
-        await gateway_manager.remove_gateway(gateway_id)
-        
-        return {"ok": True}
-    finally:
-        await db.close()
+        session_ids.invalidate(gateway_id)
+
+    # Disconnect
+    await gateway_manager.remove_gateway(gateway_id)
+
+    return {"ok": True}
 
 
 @router.get("/{gateway_id}/status", response_model=GatewayStatus)
@@ -96,14 +99,23 @@ async def get_gateway_status(gateway_id: str):
     )
 
 
+async def _known_gateway_hosts() -> List[str]:
+    """Hosts of configured gateways, which don't need to be rediscovered"""
+    async with db_pool.connection() as db:
+        cursor = await db.execute("SELECT url FROM gateways")
+        return [urlparse(row["url"]).hostname for row in await cursor.fetchall()]
+
+
 @router.post("/scan", response_model=List[DiscoveredGateway])
 async def scan_for_gateways():
     """
     Scan the local network for OpenClaw gateways.
     Auto-detects the local subnet and probes port 18789 on all hosts.
     """
+    known_hosts = await _known_gateway_hosts()
+
     try:
-        discovered = await scan_network()
+        discovered = await scan_network(exclude=known_hosts)
         return [
             DiscoveredGateway(
                 ip=gw["ip"],
@@ -115,3 +127,21 @@ async def scan_for_gateways():
         ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Scan failed: {str(e)}")
+
+
+@router.get("/scan/stream")
+async def stream_scan_for_gateways():
+    """
+    Scan the local network as a Server-Sent Events stream.
+    Each discovered gateway is sent as a `data:` event the moment it answers,
+    followed by a final `done` event. Disconnecting cancels the remaining probes.
+    """
+    known_hosts = await _known_gateway_hosts()
+
+    async def events():
+        async for gw in discover_gateways(exclude=known_hosts):
+            found = DiscoveredGateway(ip=gw["ip"], port=gw["port"], url=gw["url"], metadata=gw)
+            yield f"data: {found.model_dump_json()}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -1,16 +1,22 @@
 from fastapi import APIRouter, HTTPException, Query
 from typing import List, Optional
-from models import MessageResponse
-from database import get_db
+from models import MessageResponse, from_row
+from database import db_pool
 import asyncio
-import importlib
+import logging
+from gateway_manager import gateway_manager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/gateways/{gateway_id}/sessions/{session_key:path}/messages", tags=["messages"])
 
 
-def _get_gateway_manager():
-    mod = importlib.import_module("gateway_manager")
-    return mod.gateway_manager
+def _iso_from_ms(ts: Optional[int]) -> Optional[str]:
+    """Format a millisecond Unix timestamp as UTC ISO-8601"""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts / 1000, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
 
 
 def _extract_text(content) -> str:
@@ -42,13 +48,12 @@ async def get_messages(
     before: Optional[int] = None
 ):
     """Get messages for a session - fetches from gateway first, falls back to SQLite"""
-    manager = _get_gateway_manager()
-    conn = manager.get_connection(gateway_id)
+    conn = gateway_manager.get_connection(gateway_id)
     
     # Try fetching from gateway
     if conn and conn.connected:
         try:
-            print(f"📜 Fetching history for {session_key} from {gateway_id}")
+            logger.debug("fetching history for %s from %s", session_key, gateway_id)
             result = await asyncio.wait_for(
                 conn.request("chat.history", {
                     "sessionKey": session_key,
@@ -56,7 +61,7 @@ async def get_messages(
                 }),
                 timeout=10
             )
-            print(f"📜 Got result: ok={result.get('ok') if result else None}, keys={list(result.keys()) if result else None}")
+            logger.debug("history result ok=%s keys=%s", result.get("ok") if result else None, result.keys() if result else None)
             payload = result.get("payload", result) if result else None
             if payload and isinstance(payload, dict):
                 messages = []
@@ -77,48 +82,67 @@ async def get_messages(
                     ))
                 return messages
         except Exception as e:
-            print(f"⚠️ Failed to fetch history from gateway {gateway_id}: {e}")
+            logger.warning("failed to fetch history from gateway %s: %s", gateway_id, e)
     
     # Fallback to SQLite
-    db = await get_db()
-    try:
-        cursor = await db.execute(
+    async with db_pool.connection() as db:
+        rows = await db.execute_fetchall(
             "SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?",
             (gateway_id, session_key)
         )
-        row = await cursor.fetchone()
         
-        if not row:
+        if not rows:
             return []  # No local session, return empty instead of 404
         
-        session_id = row["id"]
+        session_id = rows[0]["id"]
         
+        anchor = None
         if before:
+            anchor = await db.execute_fetchall(
+                "SELECT timestamp, id FROM messages WHERE id = ?", (before,)
+            )
+
+        if anchor:
+            # Page on the same (timestamp, id) key the index is sorted by, so the
+            # query is a bounded range scan instead of skipping every newer row
+            cursor = await db.execute(
+                """SELECT * FROM (
+                       SELECT * FROM messages
+                       WHERE session_id = ? AND (timestamp, id) < (?, ?)
+                       ORDER BY timestamp DESC, id DESC LIMIT ?
+                   ) ORDER BY timestamp, id""",
+                (session_id, anchor[0]["timestamp"], anchor[0]["id"], limit)
+            )
+        elif before:
+            # The anchor message is gone (e.g. deleted): fall back to id order
             cursor = await db.execute(
-                """SELECT * FROM messages 
-                   WHERE session_id = ? AND id < ? 
-                   ORDER BY id DESC LIMIT ?""",
+                """SELECT * FROM (
+                       SELECT * FROM messages
+                       WHERE session_id = ? AND id < ?
+                       ORDER BY timestamp DESC, id DESC LIMIT ?
+                   ) ORDER BY timestamp, id""",
                 (session_id, before, limit)
             )
         else:
             cursor = await db.execute(
-                """SELECT * FROM messages 
-                   WHERE session_id = ? 
-                   ORDER BY id DESC LIMIT ?""",
+                """SELECT * FROM (
+                       SELECT * FROM messages
+                       WHERE session_id = ?
+                       ORDER BY timestamp DESC, id DESC LIMIT ?
+                   ) ORDER BY timestamp, id""",
                 (session_id, limit)
             )
         
         rows = await cursor.fetchall()
         return [
-            MessageResponse(
+            from_row(
+                MessageResponse,
                 id=row["id"],
                 session_id=row["session_id"],
                 role=row["role"],
                 content=row["content"],
                 timestamp=row["timestamp"],
-                created_at=row["created_at"]
+                created_at=_iso_from_ms(row["timestamp"])
             )
-            for row in reversed(rows)
+            for row in rows
         ]
-    finally:
-        await db.close()
@@ -1,198 +1,277 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from models import SessionCreate, SessionResponse
-from database import get_db
-import importlib
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from typing import Any, Dict, List, Tuple
+from models import SessionCreate, SessionResponse, from_row
+from database import db_pool, db_conn, db_writer, session_ids
+from gateway_manager import gateway_manager
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/gateways/{gateway_id}/sessions", tags=["sessions"])
 
+# Short-lived read-through cache for session reads: key -> (expiry, value).
+# Entries are dropped when this backend creates or deletes the session.
+SESSIONS_CACHE_TTL = 2.0
+SESSIONS_CACHE_SIZE = 1024
+_sessions_cache: Dict[tuple, Tuple[float, Any]] = {}
+
+# Gateway RPC failures by (gateway id, method, reason), served by /metrics
+rpc_failures: Counter = Counter()
+
+# How long list_sessions waits on the gateway before using the local copy
+SESSIONS_LIST_TIMEOUT = 1.5
+
+# In-flight gateway RPCs by (method, gateway id), shared by concurrent callers
+_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+# Session queries run via execute_fetchall: one hop to the connection's
+# thread rather than two.
+SESSION_COLUMNS = "id, gateway_id, session_key, title, agent_id, model, created_at, last_activity"
+# Rows are bound positionally against this (sqlite3.Row name lookups scan the columns)
+SESSION_FIELDS = tuple(SESSION_COLUMNS.split(", "))
+SQL_LIST_SESSIONS = f"""
+    SELECT {SESSION_COLUMNS}
+    FROM sessions
+    WHERE gateway_id = ?
+    ORDER BY last_activity DESC
+    LIMIT ? OFFSET ?
+"""
+SQL_INSERT_SESSION = f"""
+    INSERT INTO sessions (gateway_id, session_key, title, agent_id, model)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(gateway_id, session_key) DO UPDATE SET
+        title = COALESCE(excluded.title, title),
+        agent_id = COALESCE(excluded.agent_id, agent_id),
+        model = COALESCE(excluded.model, model),
+        last_activity = CURRENT_TIMESTAMP
+    RETURNING {SESSION_COLUMNS}
+"""
+SQL_GET_SESSION = f"SELECT {SESSION_COLUMNS} FROM sessions WHERE gateway_id = ? AND session_key = ?"
+SQL_DELETE_SESSION_MESSAGES = (
+    "DELETE FROM messages WHERE session_id IN (SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?)"
+)
+SQL_DELETE_SESSION = "DELETE FROM sessions WHERE gateway_id = ? AND session_key = ? RETURNING id"
+
+
+def _rpc_failed(gateway_id: str, method: str, reason: str):
+    key = (gateway_id, method, reason)
+    rpc_failures[key] += 1
+    count = rpc_failures[key]
+    # Log the first failure of each kind and then every 100th, not every request
+    if count == 1 or count % 100 == 0:
+        logger.warning("%s request to gateway %s failed (%s), %d so far", method, gateway_id, reason, count)
+
+
+async def _rpc(conn, method: str, params: dict, timeout: float = 2.0):
+    """Gateway request bounded by `timeout`; None if the gateway doesn't answer in time"""
+    try:
+        result = await asyncio.wait_for(conn.request(method, params), timeout)
+    except asyncio.TimeoutError:
+        _rpc_failed(conn.gateway_id, method, "timeout")
+        return None
+    if result is None:
+        # request() already swallowed a send error or its own timeout
+        _rpc_failed(conn.gateway_id, method, "no_response")
+    elif result.get("ok") is False:
+        _rpc_failed(conn.gateway_id, method, "error")
+    return result
+
+
+async def _shared_rpc(conn, method: str, timeout: float = 2.0):
+    """_rpc, but concurrent calls for the same gateway and method share one request"""
+    key = (method, conn.gateway_id)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_rpc(conn, method, {}, timeout))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shielded so one caller going away doesn't cancel it for the rest
+    return await asyncio.shield(task)
+
+
+def _pick(data: dict, *paths: str, default=None):
+    """First non-None value among dotted key paths, without building empty dicts on misses"""
+    for path in paths:
+        value = data
+        for key in path.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                break
+        if value is not None:
+            return value
+    return default
+
 
-def _get_gateway_manager():
-    """Lazy import to avoid circular deps"""
-    mod = importlib.import_module("gateway_manager")
-    return mod.gateway_manager
+def _gateway_session(s: dict, gateway_id: str) -> dict:
+    """Session entry from the gateway's sessions.list reply, in SessionResponse shape"""
+    created_at = s.get("createdAt", "")
+    return {
+        "id": 0,
+        "gateway_id": gateway_id,
+        "session_key": _pick(s, "key", "sessionKey", default=""),
+        "title": s.get("title"),
+        "agent_id": s.get("agentId"),
+        "model": s.get("model"),
+        "created_at": created_at,
+        "last_activity": _pick(s, "lastActivity", default=created_at)
+    }
+
+
+def _row_to_session(row) -> SessionResponse:
+    return from_row(SessionResponse, **dict(zip(SESSION_FIELDS, row)))
+
+
+def _cache_get(key: tuple) -> Any:
+    entry = _sessions_cache.get(key)
+    if entry is None or time.monotonic() > entry[0]:
+        return None
+    return entry[1]
+
+
+def _cache_put(key: tuple, value: Any):
+    if len(_sessions_cache) >= SESSIONS_CACHE_SIZE:
+        now = time.monotonic()
+        for stale in [k for k, (expiry, _) in _sessions_cache.items() if expiry < now]:
+            del _sessions_cache[stale]
+        if len(_sessions_cache) >= SESSIONS_CACHE_SIZE:
+            del _sessions_cache[next(iter(_sessions_cache))]
+    _sessions_cache[key] = (time.monotonic() + SESSIONS_CACHE_TTL, value)
+
+
+def _invalidate_sessions(gateway_id: str, session_key: str):
+    for key in [k for k in _sessions_cache if k[0] == "list" and k[1] == gateway_id]:
+        del _sessions_cache[key]
+    _sessions_cache.pop(("get", gateway_id, session_key), None)
 
 
 @router.get("", response_model=List[SessionResponse])
-async def list_sessions(gateway_id: str):
+async def list_sessions(
+    gateway_id: str,
+    limit: int = Query(200, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    include_context: bool = False
+):
     """List sessions by querying the gateway directly, merged with local data"""
-    manager = _get_gateway_manager()
-    conn = manager.get_connection(gateway_id)
+    key = ("list", gateway_id, limit, offset)
+    sessions = _cache_get(key)
+    if sessions is None:
+        sessions = await _load_sessions(gateway_id, limit, offset)
+        _cache_put(key, sessions)
+
+    if include_context:
+        # One status RPC covers every session, instead of a /context call each
+        conn = gateway_manager.get_connection(gateway_id)
+        contexts = await _recent_contexts(conn) if conn and conn.connected else {}
+        sessions = [{**s, "context": contexts.get(s["session_key"])} for s in sessions]
+    # Plain dicts straight to orjson; response_model is kept for the schema only
+    return ORJSONResponse(sessions)
+
+
+async def _load_sessions(gateway_id: str, limit: int, offset: int) -> List[dict]:
+    conn = gateway_manager.get_connection(gateway_id)
     
     gateway_sessions = []
     if conn and conn.connected:
         try:
-            import asyncio
-            result = await asyncio.wait_for(
-                conn.request("sessions.list", {}),
-                timeout=5
-            )
+            result = await _shared_rpc(conn, "sessions.list", timeout=SESSIONS_LIST_TIMEOUT)
             payload = result.get("payload", result) if result else None
             if payload and isinstance(payload, dict):
-                for s in payload.get("sessions", []):
-                    gateway_sessions.append(
-                        SessionResponse(
-                            id=0,
-                            gateway_id=gateway_id,
-                            session_key=s.get("key", s.get("sessionKey", "")),
-                            title=s.get("title"),
-                            agent_id=s.get("agentId"),
-                            model=s.get("model"),
-                            created_at=s.get("createdAt", ""),
-                            last_activity=s.get("lastActivity", s.get("createdAt", ""))
-                        )
-                    )
-        except Exception as e:
-            print(f"⚠️ Failed to fetch sessions from gateway {gateway_id}: {e}")
+                gateway_sessions = [_gateway_session(s, gateway_id) for s in payload.get("sessions", ())]
+        except (AttributeError, TypeError, ValueError) as e:
+            # Reply didn't have the shape we expect
+            _rpc_failed(gateway_id, "sessions.list", "protocol")
+            logger.debug("Unexpected sessions.list reply from gateway %s: %s", gateway_id, e)
     
     # If we got sessions from the gateway, return those (they're authoritative)
     if gateway_sessions:
-        return gateway_sessions
+        return gateway_sessions[offset:offset + limit]
     
-    # Fallback to local SQLite sessions
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            """SELECT id, gateway_id, session_key, title, agent_id, model, 
-                      created_at, last_activity 
-               FROM sessions 
-               WHERE gateway_id = ? 
-               ORDER BY last_activity DESC""",
-            (gateway_id,)
-        )
-        rows = await cursor.fetchall()
+    # Fallback to local SQLite sessions (a scoped connection rather than a
+    # dependency, so none is held while waiting on the gateway above)
+    async with db_pool.connection() as db:
+        rows = await db.execute_fetchall(SQL_LIST_SESSIONS, (gateway_id, limit, offset))
         
-        return [
-            SessionResponse(
-                id=row["id"],
-                gateway_id=row["gateway_id"],
-                session_key=row["session_key"],
-                title=row["title"],
-                agent_id=row["agent_id"],
-                model=row["model"],
-                created_at=row["created_at"],
-                last_activity=row["last_activity"]
-            )
-            for row in rows
-        ]
-    finally:
-        await db.close()
+        return [dict(zip(SESSION_FIELDS, row)) for row in rows]
 
 
 @router.post("", response_model=SessionResponse)
-async def create_session(gateway_id: str, session: SessionCreate):
-    """Create a new session"""
-    db = await get_db()
+async def create_session(gateway_id: str, session: SessionCreate, db=Depends(db_writer)):
+    """Create a session, or return the existing one for a repeated session_key"""
     try:
-        cursor = await db.execute(
-            """INSERT INTO sessions (gateway_id, session_key, title, agent_id, model) 
-               VALUES (?, ?, ?, ?, ?)""",
+        rows = await db.execute_fetchall(
+            SQL_INSERT_SESSION,
             (gateway_id, session.session_key, session.title, session.agent_id, session.model)
         )
         await db.commit()
-        
-        session_id = cursor.lastrowid
-        
-        # Fetch the created session
-        cursor = await db.execute(
-            "SELECT * FROM sessions WHERE id = ?",
-            (session_id,)
-        )
-        row = await cursor.fetchone()
-        
-        return SessionResponse(
-            id=row["id"],
-            gateway_id=row["gateway_id"],
-            session_key=row["session_key"],
-            title=row["title"],
-            agent_id=row["agent_id"],
-            model=row["model"],
-            created_at=row["created_at"],
-            last_activity=row["last_activity"]
-        )
+        _invalidate_sessions(gateway_id, session.session_key)
+    
+        return _row_to_session(rows[0])
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        await db.close()
 
 
 @router.get("/{session_key}", response_model=SessionResponse)
-async def get_session(gateway_id: str, session_key: str):
+async def get_session(gateway_id: str, session_key: str, db=Depends(db_conn)):
     """Get session info"""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT * FROM sessions WHERE gateway_id = ? AND session_key = ?",
-            (gateway_id, session_key)
-        )
-        row = await cursor.fetchone()
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        return SessionResponse(
-            id=row["id"],
-            gateway_id=row["gateway_id"],
-            session_key=row["session_key"],
-            title=row["title"],
-            agent_id=row["agent_id"],
-            model=row["model"],
-            created_at=row["created_at"],
-            last_activity=row["last_activity"]
-        )
-    finally:
-        await db.close()
+    session = _cache_get(("get", gateway_id, session_key))
+    if session is not None:
+        return session
+
+    rows = await db.execute_fetchall(SQL_GET_SESSION, (gateway_id, session_key))
+    
+    if not rows:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    session = _row_to_session(rows[0])
+    _cache_put(("get", gateway_id, session_key), session)
+    return session
 
 
 @router.delete("/{session_key}")
-async def delete_session(gateway_id: str, session_key: str):
+async def delete_session(gateway_id: str, session_key: str, db=Depends(db_writer)):
     """Delete a session and all its messages"""
-    db = await get_db()
-    try:
-        # Get session ID
-        cursor = await db.execute(
-            "SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?",
-            (gateway_id, session_key)
-        )
-        row = await cursor.fetchone()
-        
-        if not row:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        session_id = row["id"]
-        
-        # Delete messages
-        await db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-        
-        # Delete session
-        await db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-        
-        await db.commit()
-        
-        return {"ok": True}
-    finally:
-        await db.close()
+    await db.execute("BEGIN IMMEDIATE")
+    await db.execute(SQL_DELETE_SESSION_MESSAGES, (gateway_id, session_key))
+    deleted = await db.execute_fetchall(SQL_DELETE_SESSION, (gateway_id, session_key))
+
+    if not deleted:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    await db.commit()
+    session_ids.invalidate(gateway_id, session_key)
+    _invalidate_sessions(gateway_id, session_key)
+
+    return {"ok": True}
 
 
 @router.get("/{session_key}/context")
 async def get_session_context(gateway_id: str, session_key: str):
     """Get session context usage by querying the gateway RPC"""
-    gm = _get_gateway_manager()
-    conn = gm.get_connection(gateway_id)
+    conn = gateway_manager.get_connection(gateway_id)
     if not conn or not conn.connected:
         raise HTTPException(status_code=404, detail="Gateway not connected")
     
+    contexts = await _recent_contexts(conn)
+    return contexts.get(session_key) or {"contextTokens": None, "maxTokens": None, "percentage": None}
+
+
+async def _recent_contexts(conn) -> Dict[str, dict]:
+    """Context usage of the gateway's recent sessions, by session key"""
     # Query gateway status RPC — session data is in sessions.recent[]
-    result = await conn.request("status", {})
-    if result and result.get("ok"):
-        sessions = result.get("payload", {}).get("sessions", {}).get("recent", [])
-        for s in sessions:
-            if s.get("key") == session_key:
-                return {
-                    "contextTokens": s.get("totalTokens"),
-                    "maxTokens": s.get("contextTokens", 200000),
-                    "percentage": s.get("percentUsed")
-                }
-
-    return {"contextTokens": None, "maxTokens": None, "percentage": None}
+    result = await _shared_rpc(conn, "status")
+    if not result or not result.get("ok"):
+        return {}
+    return {
+        s.get("key"): {
+            "contextTokens": s.get("totalTokens"),
+            "maxTokens": s.get("contextTokens", 200000),
+            "percentage": s.get("percentUsed")
+        }
+        for s in _pick(result, "payload.sessions.recent", default=())
+    }
@@ -1,54 +1,104 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from gateway_manager import gateway_manager
-from database import get_db
-import json
-import uuid
+from database import db_pool, message_writer, session_ids
+import orjson
+import os
 import asyncio
 import re
 from typing import List, Dict, Optional
 
 router = APIRouter()
 
-
-async def ensure_session_exists(db, gateway_id: str, session_key: str):
+# Find-or-create a session, returning its id
+SQL_UPSERT_SESSION = """
+    INSERT INTO sessions (gateway_id, session_key) VALUES (?, ?)
+    ON CONFLICT(gateway_id, session_key) DO UPDATE SET last_activity = CURRENT_TIMESTAMP
+    RETURNING id
+"""
+# Latest `limit` messages of a session, oldest first
+SQL_HISTORY = """
+    SELECT role, content, timestamp FROM (
+        SELECT role, content, timestamp, id
+        FROM messages
+        WHERE session_id = (SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ) ORDER BY timestamp, id
+"""
+
+# Frames a federated socket can have waiting to be sent
+OUTBOUND_QUEUE_SIZE = 16
+
+# @gateway or @gateway:agent
+_MENTION_RE = re.compile(r'@([\w-]+)(?::([\w-]+))?')
+
+
+async def ensure_session_exists(gateway_id: str, session_key: str):
     """Ensure session exists in database, create if not"""
-    cursor = await db.execute(
-        "SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?",
-        (gateway_id, session_key)
-    )
-    row = await cursor.fetchone()
-    
-    if not row:
-        # Create new session
-        await db.execute(
-            "INSERT INTO sessions (gateway_id, session_key) VALUES (?, ?)",
-            (gateway_id, session_key)
-        )
-        await db.commit()
-        
-        cursor = await db.execute(
-            "SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?",
-            (gateway_id, session_key)
-        )
+    session_id = session_ids.get(gateway_id, session_key)
+    if session_id is not None:
+        return session_id
+
+    async with db_pool.writer() as db:
+        # A concurrent first message for the same session may have just added it
+        session_id = session_ids.get(gateway_id, session_key)
+        if session_id is not None:
+            return session_id
+
+        # One statement whether or not the session already exists
+        cursor = await db.execute(SQL_UPSERT_SESSION, (gateway_id, session_key))
         row = await cursor.fetchone()
+        await db.commit()
+    session_id = row["id"]
     
-    return row["id"]
+    session_ids.put(gateway_id, session_key, session_id)
+    return session_id
+
+
+async def send_json(websocket: WebSocket, data):
+    """Send `data` as a JSON text frame, serialized with orjson"""
+    await websocket.send_text(orjson.dumps(data).decode())
+
+
+async def receive_json(websocket: WebSocket):
+    """Next frame parsed with orjson; binary frames are accepted as well as text"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    return orjson.loads(text if text is not None else message["bytes"])
 
 
-async def save_message(db, session_id: int, role: str, content: str, timestamp: int = None):
+def clean_content(conn, content: list) -> list:
+    """Strip thinking tags from text blocks; other blocks (tool_use, tool_result, ...) pass through"""
+    return [
+        {"type": "text", "text": conn.strip_thinking_tags(block.get("text", ""))}
+        if block.get("type") == "text" else block
+        for block in content
+    ]
+
+
+def coalesce_deltas(queue: asyncio.Queue, payload: dict):
+    """Skip ahead to the newest of the deltas already queued behind `payload`.
+
+    Each delta carries the full message so far, so only the latest needs
+    sending. Returns (payload to send, a queued event that ended the run of
+    deltas or None).
+    """
+    while payload.get("state") == "delta" and not queue.empty():
+        queued = queue.get_nowait()
+        if (queued.get("state") != "delta"
+                or queued.get("sessionKey") != payload.get("sessionKey")
+                or queued.get("runId") != payload.get("runId")):
+            return payload, queued
+        payload = queued
+    return payload, None
+
+
+def save_message(session_id: int, role: str, content: str, timestamp: int = None):
     """Save a message to database"""
-    await db.execute(
-        "INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-        (session_id, role, content, timestamp)
-    )
-    await db.commit()
-    
-    # Update session activity
-    await db.execute(
-        "UPDATE sessions SET last_activity = CURRENT_TIMESTAMP WHERE id = ?",
-        (session_id,)
-    )
-    await db.commit()
+    # The background writer batches the insert and the session's last_activity bump
+    message_writer.enqueue(session_id, role, content, timestamp)
 
 
 @router.websocket("/ws/chat/{gateway_id}")
@@ -64,7 +114,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
     conn = gateway_manager.get_connection(gateway_id)
     
     if not conn:
-        await websocket.send_json({
+        await send_json(websocket, {
             "type": "error",
             "error": "Gateway not found"
         })
@@ -72,7 +122,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
         return
     
     if not conn.connected:
-        await websocket.send_json({
+        await send_json(websocket, {
             "type": "error",
             "error": "Gateway not connected"
         })
@@ -80,7 +130,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
         return
     
     # Send initial status
-    await websocket.send_json({
+    await send_json(websocket, {
         "type": "connected",
         "agents": conn.agents,
         "models": conn.models,
@@ -92,11 +142,11 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
     session_status_events = asyncio.Queue()
 
     async def handle_chat_event(payload):
-        await chat_events.put(payload)
+        chat_events.put_nowait(payload)
 
     async def handle_session_status_event(payload):
         # Session status events contain contextTokens/maxTokens
-        await session_status_events.put(payload)
+        session_status_events.put_nowait(payload)
 
     conn.on_event("chat", handle_chat_event)
     conn.on_event("session.status", handle_session_status_event)
@@ -104,7 +154,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
     # Set up reconnection notification for this WebSocket
     async def handle_reconnect():
         try:
-            await websocket.send_json({
+            await send_json(websocket, {
                 "type": "reconnected",
                 "agents": conn.agents,
                 "models": conn.models,
@@ -129,7 +179,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                 print(f"[session.status] Received: {payload}")
 
                 # Forward to browser
-                await websocket.send_json({
+                await send_json(websocket, {
                     "type": "session_status",
                     "status": payload
                 })
@@ -139,9 +189,11 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
 
     # Background task to forward chat events to browser
     async def forward_chat_events():
+        held = None
         while True:
             try:
-                payload = await chat_events.get()
+                payload = held if held is not None else await chat_events.get()
+                payload, held = coalesce_deltas(chat_events, payload)
                 state = payload.get("state")
                 
                 if state == "delta":
@@ -149,7 +201,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                     message = payload.get("message", {})
                     content = message.get("content", [])
 
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "stream",
                         "state": "delta",
                         "content": content
@@ -160,16 +212,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                     message = payload.get("message", {})
                     content = message.get("content", [])
 
-                    # Strip thinking tags from text blocks only
-                    cleaned_content = []
-                    for block in content:
-                        if block.get("type") == "text":
-                            text = block.get("text", "")
-                            cleaned_text = conn.strip_thinking_tags(text)
-                            cleaned_content.append({"type": "text", "text": cleaned_text})
-                        else:
-                            # Preserve non-text blocks as-is (tool_use, tool_result, etc.)
-                            cleaned_content.append(block)
+                    cleaned_content = clean_content(conn, content)
 
                     # Forward usage/context info if available
                     # Check multiple possible locations for usage data
@@ -225,7 +268,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                             }
                             print(f"[final] Using session status data: {ctx_tokens}/{max_tokens} tokens")
 
-                    await websocket.send_json(final_msg)
+                    await send_json(websocket, final_msg)
 
                     # After sending the final message, request gateway status for real context data
                     try:
@@ -240,7 +283,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                                         ctx_max = s.get("contextTokens", 200000)
                                         pct = s.get("percentUsed")
                                         if ctx_used is not None:
-                                            await websocket.send_json({
+                                            await send_json(websocket, {
                                                 "type": "session_status",
                                                 "status": {
                                                     "contextTokens": ctx_used,
@@ -255,7 +298,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
 
                 elif state == "error":
                     error_msg = payload.get("error", "Unknown error")
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "stream",
                         "state": "error",
                         "error": error_msg
@@ -271,12 +314,12 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
     try:
         while True:
             # Receive message from browser
-            data = await websocket.receive_json()
+            data = await receive_json(websocket)
             msg_type = data.get("type")
 
             if msg_type == "ping":
                 # Respond to ping with pong
-                await websocket.send_json({"type": "pong"})
+                await send_json(websocket, {"type": "pong"})
                 continue
 
             elif msg_type == "chat":
@@ -285,25 +328,21 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                 message = data.get("message")
                 
                 if not session_key or not message:
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "error": "Missing sessionKey or message"
                     })
                     continue
                 
                 # Ensure session exists and get ID
-                db = await get_db()
-                try:
-                    session_id = await ensure_session_exists(db, gateway_id, session_key)
-                    
-                    # Save user message
-                    user_content = json.dumps([{"type": "text", "text": message}])
-                    await save_message(db, session_id, "user", user_content)
-                finally:
-                    await db.close()
+                session_id = await ensure_session_exists(gateway_id, session_key)
+                
+                # Save user message
+                user_content = orjson.dumps([{"type": "text", "text": message}]).decode()
+                save_message(session_id, "user", user_content)
                 
                 # Send chat request to gateway
-                idempotency_key = str(uuid.uuid4())
+                idempotency_key = os.urandom(16).hex()
                 response = await conn.request("chat.send", {
                     "sessionKey": session_key,
                     "message": message,
@@ -313,7 +352,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                 
                 if not response or not response.get("ok"):
                     error = response.get("error", "Unknown error") if response else "No response"
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "error": error
                     })
@@ -322,7 +361,7 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                 session_key = data.get("sessionKey")
                 
                 if not session_key:
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "error": "Missing sessionKey"
                     })
@@ -338,53 +377,31 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
                 limit = data.get("limit", 50)
                 
                 if not session_key:
-                    await websocket.send_json({
+                    await send_json(websocket, {
                         "type": "error",
                         "error": "Missing sessionKey"
                     })
                     continue
                 
-                # Fetch from database
-                db = await get_db()
-                try:
-                    cursor = await db.execute(
-                        "SELECT id FROM sessions WHERE gateway_id = ? AND session_key = ?",
-                        (gateway_id, session_key)
-                    )
-                    row = await cursor.fetchone()
-                    
-                    if row:
-                        session_id = row["id"]
-                        cursor = await db.execute(
-                            """SELECT role, content, timestamp 
-                               FROM messages 
-                               WHERE session_id = ? 
-                               ORDER BY id DESC 
-                               LIMIT ?""",
-                            (session_id, limit)
-                        )
-                        rows = await cursor.fetchall()
-                        
-                        messages = [
-                            {
-                                "role": row["role"],
-                                "content": json.loads(row["content"]),
-                                "timestamp": row["timestamp"]
-                            }
-                            for row in reversed(rows)
-                        ]
-                        
-                        await websocket.send_json({
-                            "type": "history",
-                            "messages": messages
-                        })
-                    else:
-                        await websocket.send_json({
-                            "type": "history",
-                            "messages": []
-                        })
-                finally:
-                    await db.close()
+                # Fetch from database; the session is resolved through its
+                # UNIQUE(gateway_id, session_key) index in the same query
+                async with db_pool.connection() as db:
+                    rows = await db.execute_fetchall(SQL_HISTORY, (gateway_id, session_key, limit))
+
+                # Stored content is already JSON; embed it in the frame unparsed
+                messages = [
+                    {
+                        "role": row["role"],
+                        "content": orjson.Fragment(row["content"]),
+                        "timestamp": row["timestamp"]
+                    }
+                    for row in rows
+                ]
+
+                await send_json(websocket, {
+                    "type": "history",
+                    "messages": messages
+                })
     
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for gateway {gateway_id}")
@@ -407,17 +424,89 @@ async def websocket_chat(websocket: WebSocket, gateway_id: str):
 
 def parse_mentions(message: str) -> List[Dict[str, str]]:
     """Parse @mentions from message, format: @gateway:agent or @gateway"""
-    mention_pattern = r'@([\w-]+)(?::([\w-]+))?'
-    matches = re.findall(mention_pattern, message)
-
-    mentions = []
-    for gateway_id, agent_id in matches:
-        mentions.append({
-            "gateway_id": gateway_id,
-            "agent_id": agent_id if agent_id else None
+    return [
+        {"gateway_id": gateway_id, "agent_id": agent_id or None}
+        for gateway_id, agent_id in _MENTION_RE.findall(message)
+    ]
+
+
+def make_event_handler(queue: asyncio.Queue):
+    """Gateway event handler that hands payloads to a forwarder queue"""
+    async def handler(payload):
+        queue.put_nowait(payload)
+
+    return handler
+
+
+def make_reconnect_handler(notify, gateway_id: str):
+    """Reconnect callback that tells a federated socket the gateway is back"""
+    async def reconnect_handler():
+        # Only queues the frame: the gateway's reconnect loop must never wait
+        # on a browser
+        notify({
+            "type": "reconnected",
+            "gateway_id": gateway_id
         })
 
-    return mentions
+    return reconnect_handler
+
+
+async def forward_gateway_events(push, queue: asyncio.Queue, conn, gateway_id: str):
+    """Forward one gateway's chat events to a federated socket via `push`"""
+    held = None
+    while True:
+        try:
+            payload = held if held is not None else await queue.get()
+            payload, held = coalesce_deltas(queue, payload)
+            state = payload.get("state")
+
+            # Extract agent name from payload
+            message = payload.get("message", {})
+            agent_name = message.get("agent", {}).get("name", "unknown")
+
+            if state == "delta":
+                content = message.get("content", [])
+
+                await push({
+                    "type": "stream",
+                    "source": {
+                        "gateway_id": gateway_id,
+                        "agent_name": agent_name
+                    },
+                    "state": "delta",
+                    "content": content
+                })
+
+            elif state == "final":
+                content = message.get("content", [])
+
+                cleaned_content = clean_content(conn, content)
+
+                await push({
+                    "type": "stream",
+                    "source": {
+                        "gateway_id": gateway_id,
+                        "agent_name": agent_name
+                    },
+                    "state": "final",
+                    "content": cleaned_content
+                })
+
+            elif state == "error":
+                error_msg = payload.get("error", "Unknown error")
+                await push({
+                    "type": "stream",
+                    "source": {
+                        "gateway_id": gateway_id,
+                        "agent_name": agent_name
+                    },
+                    "state": "error",
+                    "error": error_msg
+                })
+
+        except Exception as e:
+            print(f"Error forwarding federated chat event from {gateway_id}: {e}")
+            break
 
 
 @router.websocket("/ws/chat/federated")
@@ -425,8 +514,44 @@ async def websocket_federated_chat(websocket: WebSocket):
     """WebSocket endpoint for federated chat across multiple gateways"""
     await websocket.accept()
 
+    # Every frame goes through one queue drained by a single sender task, so
+    # the per-gateway forwarders never write to the socket concurrently. The
+    # queue is bounded: when the browser falls behind, forwarders wait and
+    # their deltas coalesce upstream. Control frames never wait: they are
+    # dropped if the queue is full.
+    outbound: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+    send_failed = asyncio.Event()
+
+    async def push(data):
+        if send_failed.is_set() or sender_task.done():
+            raise WebSocketDisconnect()
+        await outbound.put(orjson.dumps(data).decode())
+
+    def notify(data):
+        if send_failed.is_set() or sender_task.done():
+            return
+        try:
+            outbound.put_nowait(orjson.dumps(data).decode())
+        except asyncio.QueueFull:
+            print(f"Federated WebSocket too far behind, dropped {data.get('type')} frame")
+
+    async def sender():
+        while True:
+            frame = await outbound.get()
+            try:
+                await websocket.send_text(frame)
+            except Exception as e:
+                print(f"Federated WebSocket send failed: {e}")
+                send_failed.set()
+                break
+        # Keep draining so producers already waiting in push() are released
+        while True:
+            await outbound.get()
+
+    sender_task = asyncio.create_task(sender())
+
     # Send initial status
-    await websocket.send_json({
+    notify({
         "type": "connected",
         "federated": True
     })
@@ -437,15 +562,82 @@ async def websocket_federated_chat(websocket: WebSocket):
     event_handlers = []
     reconnect_handlers = []
 
+    async def dispatch(target: dict, message: str, user_content: str):
+        """Send one chat message to one target gateway"""
+        gw_id = target["gateway_id"]
+        session_key = target["session_key"]
+
+        conn = gateway_manager.get_connection(gw_id)
+
+        if not conn:
+            notify({
+                "type": "stream",
+                "source": {"gateway_id": gw_id, "agent_name": "system"},
+                "state": "error",
+                "error": f"Gateway {gw_id} not found"
+            })
+            return
+
+        if not conn.connected:
+            notify({
+                "type": "stream",
+                "source": {"gateway_id": gw_id, "agent_name": "system"},
+                "state": "error",
+                "error": f"Gateway {gw_id} not connected"
+            })
+            return
+
+        # Set up event queue for this gateway if not exists
+        if gw_id not in gateway_queues:
+            queue = gateway_queues[gw_id] = asyncio.Queue()
+
+            # Create event handler for this gateway
+            handler = make_event_handler(queue)
+            event_handlers.append((gw_id, handler))
+            conn.on_event("chat", handler)
+
+            # Set up reconnection notification
+            reconnect_handler = make_reconnect_handler(notify, gw_id)
+            reconnect_handlers.append((gw_id, reconnect_handler))
+            conn.on_reconnect(reconnect_handler)
+
+            # Start forwarding task for this gateway
+            task = asyncio.create_task(forward_gateway_events(push, queue, conn, gw_id))
+            forward_tasks.append(task)
+
+        # Ensure session exists and save message
+        session_id = await ensure_session_exists(gw_id, session_key)
+
+        # Save user message
+        save_message(session_id, "user", user_content)
+
+        # Send chat request to gateway
+        idempotency_key = os.urandom(16).hex()
+        response = await conn.request("chat.send", {
+            "sessionKey": session_key,
+            "message": message,
+            "deliver": False,
+            "idempotencyKey": idempotency_key
+        })
+
+        if not response or not response.get("ok"):
+            error = response.get("error", "Unknown error") if response else "No response"
+            notify({
+                "type": "stream",
+                "source": {"gateway_id": gw_id, "agent_name": "system"},
+                "state": "error",
+                "error": error
+            })
+
     try:
         while True:
             # Receive message from browser
-            data = await websocket.receive_json()
+            data = await receive_json(websocket)
             msg_type = data.get("type")
 
             if msg_type == "ping":
                 # Respond to ping with pong
-                await websocket.send_json({"type": "pong"})
+                notify({"type": "pong"})
                 continue
 
             elif msg_type == "chat":
@@ -454,7 +646,7 @@ async def websocket_federated_chat(websocket: WebSocket):
                 broadcast = data.get("broadcast", False)
 
                 if not message:
-                    await websocket.send_json({
+                    notify({
                         "type": "error",
                         "error": "Missing message"
                     })
@@ -483,183 +675,30 @@ async def websocket_federated_chat(websocket: WebSocket):
                     target_gateways = targets
 
                 if not target_gateways:
-                    await websocket.send_json({
+                    notify({
                         "type": "error",
                         "error": "No valid targets"
                     })
                     continue
 
-                # Send to each target gateway
-                for target in target_gateways:
-                    gw_id = target["gateway_id"]
-                    session_key = target["session_key"]
-
-                    conn = gateway_manager.get_connection(gw_id)
-
-                    if not conn:
-                        await websocket.send_json({
-                            "type": "stream",
-                            "source": {"gateway_id": gw_id, "agent_name": "system"},
-                            "state": "error",
-                            "error": f"Gateway {gw_id} not found"
-                        })
-                        continue
-
-                    if not conn.connected:
-                        await websocket.send_json({
-                            "type": "stream",
-                            "source": {"gateway_id": gw_id, "agent_name": "system"},
-                            "state": "error",
-                            "error": f"Gateway {gw_id} not connected"
-                        })
-                        continue
-
-                    # Set up event queue for this gateway if not exists
-                    if gw_id not in gateway_queues:
-                        gateway_queues[gw_id] = asyncio.Queue()
-
-                        # Create event handler for this gateway
-                        async def make_handler(gateway_id: str):
-                            queue = gateway_queues[gateway_id]
-
-                            async def handler(payload):
-                                await queue.put(payload)
-
-                            return handler
-
-                        handler = await make_handler(gw_id)
-                        event_handlers.append((gw_id, handler))
-                        conn.on_event("chat", handler)
-
-                        # Set up reconnection notification
-                        async def make_reconnect_handler(gateway_id: str):
-                            async def reconnect_handler():
-                                try:
-                                    await websocket.send_json({
-                                        "type": "reconnected",
-                                        "gateway_id": gateway_id
-                                    })
-                                except Exception as e:
-                                    print(f"Failed to send reconnection notification: {e}")
-
-                            return reconnect_handler
-
-                        reconnect_handler = await make_reconnect_handler(gw_id)
-                        reconnect_handlers.append((gw_id, reconnect_handler))
-                        conn.on_reconnect(reconnect_handler)
-
-                        # Start forwarding task for this gateway
-                        async def forward_gateway_events(gateway_id: str):
-                            queue = gateway_queues[gateway_id]
-                            conn = gateway_manager.get_connection(gateway_id)
-
-                            while True:
-                                try:
-                                    payload = await queue.get()
-                                    state = payload.get("state")
-
-                                    # Extract agent name from payload
-                                    message = payload.get("message", {})
-                                    agent_name = message.get("agent", {}).get("name", "unknown")
-
-                                    if state == "delta":
-                                        content = message.get("content", [])
-
-                                        await websocket.send_json({
-                                            "type": "stream",
-                                            "source": {
-                                                "gateway_id": gateway_id,
-                                                "agent_name": agent_name
-                                            },
-                                            "state": "delta",
-                                            "content": content
-                                        })
-
-                                    elif state == "final":
-                                        content = message.get("content", [])
-
-                                        # Strip thinking tags from text blocks only
-                                        cleaned_content = []
-                                        for block in content:
-                                            if block.get("type") == "text":
-                                                text = block.get("text", "")
-                                                cleaned_text = conn.strip_thinking_tags(text)
-                                                cleaned_content.append({"type": "text", "text": cleaned_text})
-                                            else:
-                                                # Preserve non-text blocks as-is
-                                                cleaned_content.append(block)
-
-                                        await websocket.send_json({
-                                            "type": "stream",
-                                            "source": {
-                                                "gateway_id": gateway_id,
-                                                "agent_name": agent_name
-                                            },
-                                            "state": "final",
-                                            "content": cleaned_content
-                                        })
-
-                                    elif state == "error":
-                                        error_msg = payload.get("error", "Unknown error")
-                                        await websocket.send_json({
-                                            "type": "stream",
-                                            "source": {
-                                                "gateway_id": gateway_id,
-                                                "agent_name": agent_name
-                                            },
-                                            "state": "error",
-                                            "error": error_msg
-                                        })
-
-                                except Exception as e:
-                                    print(f"Error forwarding federated chat event from {gateway_id}: {e}")
-                                    break
-
-                        task = asyncio.create_task(forward_gateway_events(gw_id))
-                        forward_tasks.append(task)
-
-                    # Ensure session exists and save message
-                    db = await get_db()
-                    try:
-                        session_id = await ensure_session_exists(db, gw_id, session_key)
-
-                        # Save user message
-                        user_content = json.dumps([{"type": "text", "text": message}])
-                        await save_message(db, session_id, "user", user_content)
-                    finally:
-                        await db.close()
-
-                    # Send chat request to gateway
-                    idempotency_key = str(uuid.uuid4())
-                    response = await conn.request("chat.send", {
-                        "sessionKey": session_key,
-                        "message": message,
-                        "deliver": False,
-                        "idempotencyKey": idempotency_key
-                    })
-
-                    if not response or not response.get("ok"):
-                        error = response.get("error", "Unknown error") if response else "No response"
-                        await websocket.send_json({
-                            "type": "stream",
-                            "source": {"gateway_id": gw_id, "agent_name": "system"},
-                            "state": "error",
-                            "error": error
-                        })
+                # Send to every target gateway concurrently
+                user_content = orjson.dumps([{"type": "text", "text": message}]).decode()
+                async with asyncio.TaskGroup() as tg:
+                    for target in target_gateways:
+                        tg.create_task(dispatch(target, message, user_content))
 
             elif msg_type == "abort":
                 targets = data.get("targets", [])
 
-                # Abort on all target gateways
+                # Abort on all target gateways at once
+                aborts = []
                 for target in targets:
-                    gw_id = target["gateway_id"]
-                    session_key = target["session_key"]
-
-                    conn = gateway_manager.get_connection(gw_id)
+                    conn = gateway_manager.get_connection(target["gateway_id"])
                     if conn and conn.connected:
-                        await conn.request("chat.abort", {
-                            "sessionKey": session_key
-                        })
+                        aborts.append(conn.request("chat.abort", {
+                            "sessionKey": target["session_key"]
+                        }))
+                await asyncio.gather(*aborts, return_exceptions=True)
 
     except WebSocketDisconnect:
         print("Federated WebSocket disconnected")
@@ -668,9 +707,13 @@ async def websocket_federated_chat(websocket: WebSocket):
         print(f"Federated WebSocket error: {e}")
 
     finally:
-        # Cancel all forwarding tasks
+        # Cancel all forwarding tasks and the sender, then empty the queue so
+        # nothing is left waiting on it
         for task in forward_tasks:
             task.cancel()
+        sender_task.cancel()
+        while not outbound.empty():
+            outbound.get_nowait()
 
         # Clean up event handlers
         for gw_id, handler in event_handlers:
@@ -1,4 +1,4 @@
 #!/bin/bash
 cd "$(dirname "$0")"
 source venv/bin/activate
-uvicorn main:app --reload --port 8000
+uvicorn main:app --reload --port 8000 --loop uvloop --http httptools
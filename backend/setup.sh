@@ -47,5 +47,5 @@ echo "  ./run.sh"
 echo ""
 echo "Or manually:"
 echo "  source venv/bin/activate"
-echo "  uvicorn main:app --reload --port 8000"
+echo "  uvicorn main:app --reload --port 8000 --loop uvloop --http httptools"
 echo ""
@@ -2,8 +2,7 @@
 """Test federated session endpoints"""
 
 import asyncio
-import aiosqlite
-from database import get_db
+from database import db_pool
 from models import FederatedSessionGateway
 
 
@@ -12,64 +11,72 @@ async def test_federated_api():
     print("🧪 Testing federated session API...")
 
     # Test database connection
-    db = await get_db()
     try:
-        # Check tables exist
-        cursor = await db.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'federated%'"
-        )
-        tables = await cursor.fetchall()
-        print(f"✅ Found tables: {[t['name'] for t in tables]}")
-
-        # Test data insertion
-        session_id = "test-session-123"
-        await db.execute(
-            "INSERT OR REPLACE INTO federated_sessions (id, title) VALUES (?, ?)",
-            (session_id, "Test Federated Session")
-        )
-
-        await db.execute(
-            "DELETE FROM federated_session_gateways WHERE federated_session_id = ?",
-            (session_id,)
-        )
-
-        await db.execute(
-            "INSERT INTO federated_session_gateways (federated_session_id, gateway_id, session_key) VALUES (?, ?, ?)",
-            (session_id, "steve", "main")
-        )
-
-        await db.execute(
-            "INSERT INTO federated_session_gateways (federated_session_id, gateway_id, session_key) VALUES (?, ?, ?)",
-            (session_id, "neil", "main")
-        )
-
-        await db.commit()
-        print(f"✅ Inserted test federated session: {session_id}")
-
-        # Test retrieval
-        cursor = await db.execute(
-            "SELECT id, title FROM federated_sessions WHERE id = ?",
-            (session_id,)
-        )
-        row = await cursor.fetchone()
-        print(f"✅ Retrieved session: {dict(row)}")
-
-        # Test gateway associations
-        cursor = await db.execute(
-            "SELECT gateway_id, session_key FROM federated_session_gateways WHERE federated_session_id = ?",
-            (session_id,)
-        )
-        gateways = await cursor.fetchall()
-        print(f"✅ Retrieved gateways: {[dict(g) for g in gateways]}")
-
-        # Clean up
-        await db.execute("DELETE FROM federated_session_gateways WHERE federated_session_id = ?", (session_id,))
-        await db.execute("DELETE FROM federated_sessions WHERE id = ?", (session_id,))
-        await db.commit()
-        print("✅ Cleaned up test data")
+        async with db_pool.writer() as db:
+            # Check tables exist
+            cursor = await db.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'federated%'"
+            )
+            tables = await cursor.fetchall()
+            print(f"✅ Found tables: {[t['name'] for t in tables]}")
+
+            # Test data insertion
+            session_id = "test-session-123"
+            # Gateway rows are required by the foreign keys on the junction table
+            for gw_id in ("steve", "neil"):
+                await db.execute(
+                    "INSERT OR IGNORE INTO gateways (id, name, url) VALUES (?, ?, ?)",
+                    (gw_id, gw_id, f"ws://{gw_id}.test:18789")
+                )
+
+            await db.execute(
+                "INSERT OR REPLACE INTO federated_sessions (id, title) VALUES (?, ?)",
+                (session_id, "Test Federated Session")
+            )
+
+            await db.execute(
+                "DELETE FROM federated_session_gateways WHERE federated_session_id = ?",
+                (session_id,)
+            )
+
+            await db.execute(
+                "INSERT INTO federated_session_gateways (federated_session_id, gateway_id, session_key) VALUES (?, ?, ?)",
+                (session_id, "steve", "main")
+            )
+
+            await db.execute(
+                "INSERT INTO federated_session_gateways (federated_session_id, gateway_id, session_key) VALUES (?, ?, ?)",
+                (session_id, "neil", "main")
+            )
+
+            await db.commit()
+            print(f"✅ Inserted test federated session: {session_id}")
+
+            # Test retrieval
+            cursor = await db.execute(
+                "SELECT id, title FROM federated_sessions WHERE id = ?",
+                (session_id,)
+            )
+            row = await cursor.fetchone()
+            print(f"✅ Retrieved session: {dict(row)}")
+
+            # Test gateway associations
+            cursor = await db.execute(
+                "SELECT gateway_id, session_key FROM federated_session_gateways WHERE federated_session_id = ?",
+                (session_id,)
+            )
+            gateways = await cursor.fetchall()
+            print(f"✅ Retrieved gateways: {[dict(g) for g in gateways]}")
+
+            # Clean up
+            await db.execute("DELETE FROM federated_session_gateways WHERE federated_session_id = ?", (session_id,))
+            await db.execute("DELETE FROM federated_sessions WHERE id = ?", (session_id,))
+            await db.execute("DELETE FROM gateways WHERE id IN (?, ?) AND url LIKE 'ws://%.test:18789'", ("steve", "neil"))
+            await db.commit()
+            print("✅ Cleaned up test data")
 
     finally:
-        await db.close()
+        await db_pool.close()
 
     print("✅ All tests passed!")
 
@@ -41,10 +41,7 @@ async def test_gateway(url: str, token: str):
             print("\n✅ Response complete")
             message = payload.get("message", {})
             content = message.get("content", [])
-            full_text = ""
-            for block in content:
-                if block.get("type") == "text":
-                    full_text += block.get("text", "")
+            full_text = "".join(block.get("text", "") for block in content if block.get("type") == "text")
             responses.append(conn.strip_thinking_tags(full_text))
         elif state == "error":
             print(f"\n❌ Error: {payload.get('error')}")